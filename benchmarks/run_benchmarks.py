@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Benchmarks rendering for every combination of pattern, deformation, color
+filter and detail level, at several image sizes.
+
+Results are written as JSON, and compared against a baseline. The script
+exits with an error if any case got slower, used more memory or produced
+more polygons or bytes than allowed.
+
+Timings and memory use depend on the machine, so their baseline isn't
+committed; without it, only polygon and byte counts are checked, against
+counts.json. Both are written with --save-baseline.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --patterns beehive --sizes 64x64
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import panavatar  # noqa: E402
+
+
+PATTERNS = ["triangles", "squares", "barssquares", "beehive", "blocks",
+            "corner", "brick", "roadbrick", "sparsesquares"]
+
+DEFORMATIONS = ["have_crumple", "have_wave", "have_zoom"]
+
+COLOR_FILTERS = ["noise", "noise_vignette", "vignette", "radial_hue"]
+
+# Detail levels, as a fraction of the image scale. These are the extremes
+# RandomParameters picks from.
+DETAILS = {"fine": .05, "coarse": .2}
+
+SIZES = ["64x64", "1024x786", "1920x300"]
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_COUNTS = os.path.join(os.path.dirname(__file__), "counts.json")
+
+# Metrics checked against the baseline, and how much worse they may get,
+# relatively and absolutely. Both need to be exceeded for a regression, so
+# timing noise on very fast renders doesn't count.
+TOLERANCES = {
+    "seconds": (.25, .002),
+    "peak_memory": (.25, 16 * 1024),
+    "polygons": (0, 0),
+    "bytes": (0, 0),
+}
+
+# Metrics which don't depend on the machine
+COUNTS = ["polygons", "bytes"]
+
+
+def get_cases(patterns, sizes):
+    for size, pattern, deformations, color_filter, detail in itertools.product(
+            sizes, patterns,
+            itertools.product([False, True], repeat=len(DEFORMATIONS)),
+            COLOR_FILTERS, sorted(DETAILS)):
+
+        width, height = [int(x) for x in size.split("x")]
+        img_scale = min(400, abs(width + 1j * height))
+
+        params = {
+            "seed": "benchmark",
+            "pattern": pattern,
+            "color_filter": color_filter,
+            "detail": str(img_scale * DETAILS[detail]),
+        }
+        for key, enabled in zip(DEFORMATIONS, deformations):
+            params[key] = "1" if enabled else "0"
+
+        name = "%s/%s/%s/%s/%s" % (
+            size, pattern,
+            "+".join(key[5:] for key, enabled
+                     in zip(DEFORMATIONS, deformations) if enabled) or "flat",
+            color_filter, detail)
+
+        yield name, width, height, params
+
+
+def run_case(width, height, params, repeat):
+    # Time without tracemalloc, as it slows down allocations considerably.
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        svg = panavatar.get_svg(width, height, dict(params))
+        duration = time.perf_counter() - start
+        seconds = duration if seconds is None else min(seconds, duration)
+
+    tracemalloc.start()
+    panavatar.get_svg(width, height, dict(params))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "peak_memory": peak_memory,
+        "polygons": svg.count("<path"),
+        "bytes": len(svg.encode("utf-8")),
+    }
+
+
+def compare(results, baseline, metrics=None):
+    """Returns a list of descriptions of regressions, in metrics (or all
+    metrics in the baseline)"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        for metric, (relative, absolute) in sorted(TOLERANCES.items()):
+            if metric not in baseline[name] or \
+                    (metrics is not None and metric not in metrics):
+                continue
+
+            old = baseline[name][metric]
+            new = result[metric]
+            if new > old * (1 + relative) and new > old + absolute:
+                regressions.append("%s: %s went from %s to %s" %
+                                   (name, metric, old, new))
+
+    return regressions
+
+
+def save_baseline(filename, results, metrics=None):
+    """Stores results, or only the given metrics of them, as a baseline.
+    Cases which weren't run are kept."""
+    baseline = {}
+    if os.path.exists(filename):
+        with open(filename) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    for name, result in results.items():
+        baseline[name] = {metric: value for metric, value in result.items()
+                          if metrics is None or metric in metrics}
+
+    with open(filename, "w") as output:
+        json.dump(baseline, output, indent=2, sort_keys=True)
+        output.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--patterns", nargs="+", default=PATTERNS,
+                        choices=PATTERNS)
+    parser.add_argument("--sizes", nargs="+", default=SIZES)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Take the fastest of this many renders")
+    parser.add_argument("--output", type=argparse.FileType("w"),
+                        help="Write results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline to compare against")
+    parser.add_argument("--counts", default=DEFAULT_COUNTS,
+                        help="Baseline of polygon and byte counts")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for name, width, height, params in get_cases(args.patterns, args.sizes):
+        results[name] = run_case(width, height, params, args.repeat)
+        sys.stderr.write("%-60s %8.1fms %8ikB %6i polygons %8i bytes\n" % (
+            name, results[name]["seconds"] * 1000,
+            results[name]["peak_memory"] // 1024,
+            results[name]["polygons"], results[name]["bytes"]))
+
+    if args.output:
+        json.dump(results, args.output, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        save_baseline(args.counts, results, COUNTS)
+        return
+
+    if not os.path.exists(args.counts):
+        sys.exit("No baseline found at %s, create it with --save-baseline" %
+                 args.counts)
+
+    with open(args.counts) as counts_file:
+        regressions = compare(results, json.load(counts_file))
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions += compare(
+                results, json.load(baseline_file),
+                [metric for metric in TOLERANCES if metric not in COUNTS])
+    else:
+        sys.stderr.write("No baseline found at %s, only checking counts\n" %
+                         args.baseline)
+
+    for regression in regressions:
+        sys.stderr.write("REGRESSION %s\n" % regression)
+
+    if regressions:
+        sys.exit("%i regressions found" % len(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,62 @@
+__version__ = '0.4.0'
+
+import time
+
 from . import parameters
 from . import geometry
+from . import patterns
 from . import color_scheme
+from . import context
+from . import raster
+from . import compact as compact_svg
+from . import compression
+from . import stats as render_stats
+
+
+# Parameters which change how an image is rendered, rather than the image
+RENDER_SETTINGS = ("quality", "max_polygons", "deform_version")
+
+
+def get_render_settings(params):
+    """Returns the quality, max_polygons and deform_version in a parameters
+    dict. Raises ValueError if any of them is invalid."""
+    quality = params.get("quality", "exact")
+    if quality not in parameters.QUALITY_LEVELS:
+        raise ValueError("Unknown quality %r" % (quality,))
+
+    max_polygons = params.get("max_polygons")
+    if max_polygons in (None, ""):
+        max_polygons = None
+    else:
+        try:
+            max_polygons = int(max_polygons)
+        except (TypeError, ValueError):
+            max_polygons = -1
+        if max_polygons < 0:
+            raise ValueError("max_polygons must be a non-negative integer")
+
+    deform_version = params.get("deform_version", 2)
+    if str(deform_version) not in ("1", "2"):
+        raise ValueError("Unknown deform_version %r" % (deform_version,))
+    deform_version = int(deform_version)
+
+    return quality, max_polygons or None, deform_version
 
 
-def get_svg_iter(width, height, params={}, log_choices=False):
-    # Pull the seed from the parameters.
+def get_parameters(width, height, params={}, log_choices=False, stats=None):
+    """Returns new parameters for a render, from a dict or a RenderContext"""
+    if isinstance(params, context.RenderContext):
+        if (width, height) != (params.width, params.height):
+            raise ValueError("The context was created for %ix%i" %
+                             (params.width, params.height))
+        return params.get_parameters(log_choices, stats)
+
+    # Pull the seed and render settings from the parameters.
+    params = dict(params)
     seed = params.pop("seed", None)
+    quality, max_polygons, deform_version = get_render_settings(params)
+    for key in RENDER_SETTINGS:
+        params.pop(key, None)
 
     if params or log_choices:
         params = parameters.OverridableParameters(seed, params)
@@ -13,21 +64,111 @@ def get_svg_iter(width, height, params={}, log_choices=False):
         params = parameters.RandomParameters(seed)
 
     params.size = width + 1j * height
+    params.stats = stats
+    params.quality = quality
+    params.max_polygons = max_polygons
+    params.deform_version = deform_version
+    return params
+
+
+def resolve_decisions(params):
+    """Makes the decisions which are made before rendering starts"""
+    patterns.get_pattern(params)
+    geometry.get_deformation(params)
+    color_scheme.get_color_scheme(params)
+
+
+def get_context(width, height, params={}):
+    """Resolves the parameters of a render into a context.RenderContext,
+    which can be shared between threads. Without a seed, one is picked, so
+    every render of the context produces the same image."""
+    params = dict(params)
+    if not params.get("seed"):
+        params["seed"] = "%.1f" % time.time()
 
-    yield '<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i">' % (width, height)
+    resolved = get_parameters(width, height, params)
+    resolve_decisions(resolved)
 
-    colormap = color_scheme.get_color_scheme(params)
+    seed = params.pop("seed")
+    decisions = resolved.get_decisions()
+    return context.RenderContext(width, height, seed,
+                                 tuple(sorted(params.items())),
+                                 tuple(sorted(decisions["random"].items())),
+                                 tuple(sorted(decisions["perlin"].items())))
 
-    for shape, color_index in geometry.get_geometry(params):
-        # Don't spend time om invisible polys
-        minc, maxc = geometry.get_bb(shape)
-        if maxc.real < 0 or maxc.imag < 0 or \
-                minc.real > width or minc.imag > width:
-            continue
 
+def get_polygons(params, color_tolerance=0):
+    """Yields (shape, color) for every visible polygon, with the color as a
+    hex string. See color_scheme.get_color_scheme for color_tolerance."""
+    polygons = _get_polygons(params, color_tolerance)
+    if params.stats is not None:
+        polygons = params.stats.timed("color", polygons)
+    return polygons
+
+
+def _get_polygons(params, color_tolerance):
+    colormap = color_scheme.get_color_scheme(params, color_tolerance)
+
+    for shape, centroid, color_index in geometry.get_visible_polygons(params):
         # Determine color for this polygon
-        color = colormap(geometry.get_centroid(shape), color_index)
+        yield shape, colormap(centroid, color_index)
+
+
+def get_svg_iter(width, height, params={}, log_choices=False, compact=False,
+                 color_tolerance=0, stats=None, window=None):
+    """Yields the elements of an SVG image.
+
+    To find out where rendering time goes, pass a stats.RenderStats as
+    stats.
+
+    window, an (x, y, width, height) tuple, renders only that part of the
+    image, as an SVG of the window's size. Only tiles crossing the window
+    are rendered, and they are positioned exactly as in the whole image, so
+    adjacent windows line up."""
+    params = get_parameters(width, height, params, log_choices, stats)
+    if window is not None:
+        x, y, window_width, window_height = window
+        params.window = (x + y * 1j,
+                         (x + window_width) + (y + window_height) * 1j)
+    polygons = get_polygons(params, color_tolerance)
+
+    if compact:
+        elements = compact_svg.get_elements(width, height, polygons, window)
+    else:
+        elements = get_elements(width, height, polygons, window)
+
+    if stats is not None:
+        elements = stats.timed("serialize", elements)
+
+    for element in elements:
+        yield element
+
+    if log_choices:
+        for key, value in params.results.items():
+            yield '\n<!-- %s=%s -->' % (key, value)
+
+    yield '</svg>'
+
+
+def get_elements(width, height, polygons, window=None):
+    """Yields the header and path elements for (shape, color) pairs"""
+    yield get_header(width, height, window)
+
+    for element in format_elements(polygons):
+        yield element
+
+
+def get_header(width, height, window=None):
+    if window is None:
+        return '<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i">' % (width, height)
+
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i" '
+            'viewBox="%i %i %i %i">' % ((window[2], window[3]) + tuple(window)))
 
+
+def format_elements(polygons):
+    """Yields path elements for (shape, color) pairs"""
+    for shape, color in polygons:
         # Generate the SVG path
         path = "M%.2f %.2f " % (shape[0].real, shape[0].imag)
         path += " ".join("L%.2f %.2f" % (coord.real, coord.imag)
@@ -35,21 +176,109 @@ def get_svg_iter(width, height, params={}, log_choices=False):
 
         yield '<path d="%s Z" fill="#%s" stroke="#%s"/>' % (path, color, color)
 
-    if log_choices:
-        for key, value in params.results.items():
-            yield '\n<!-- %s=%s -->' % (key, value)
 
-    yield '</svg>'
+def get_svg(width, height, params={}, compact=False, color_tolerance=0,
+            stats=None, render_cache=None, window=None):
+    """Returns an SVG image, or a window of it (see get_svg_iter). If params
+    has a seed, the image is looked up in (and stored to) render_cache, a
+    cache.RenderCache, if one is given."""
+    plain_params = params
+    if isinstance(params, context.RenderContext):
+        plain_params = params.get_params()
+
+    if render_cache is not None and plain_params.get("seed"):
+        from . import cache
+
+        variant = "compact-svg" if compact else "svg"
+        if color_tolerance:
+            variant += "-%r" % color_tolerance
+        if window is not None:
+            variant += "-window-%i,%i,%ix%i" % tuple(window)
+
+        key = cache.get_cache_key(width, height, plain_params, variant)
+        return render_cache.get_or_render(
+            key, lambda: get_svg(width, height, params, compact,
+                                 color_tolerance, stats, window=window))
+
+    return "".join(get_svg_iter(width, height, params, compact=compact,
+                                color_tolerance=color_tolerance,
+                                stats=stats, window=window))
+
+
+def get_svgz(width, height, params={}, compact=False, color_tolerance=0,
+             stats=None, window=None):
+    """Returns a gzip compressed SVG image, as stored in .svgz files. It is
+    compressed while rendering, so the whole SVG is never in memory."""
+    elements = get_svg_iter(width, height, params, compact=compact,
+                            color_tolerance=color_tolerance, stats=stats,
+                            window=window)
+    return b"".join(compression.compress_chunks(elements, "gzip"))
+
+
+def get_svgs(sizes, params={}, compact=False, color_tolerance=0):
+    """Renders the same image at several sizes, returning a dict mapping
+    (width, height) to the SVG, as get_svg would render it.
+
+    The parameters are resolved once, for all sizes. Everything else depends
+    on the size (the tile lattice is laid out from the image's corner, and
+    deformations scale with it), so every distinct size is rendered."""
+    sizes = list(sizes)
+    if not sizes:
+        return {}
+
+    params = dict(params)
+    if not params.get("seed"):
+        # Every size needs to show the same image.
+        params["seed"] = "%.1f" % time.time()
+
+    # Random decisions only depend on their key, so they can be shared.
+    resolved = get_context(sizes[0][0], sizes[0][1], params)
+
+    svgs = {}
+    for width, height in sizes:
+        if (width, height) not in svgs:
+            svgs[width, height] = get_svg(
+                width, height, resolved._replace(width=width, height=height),
+                compact=compact, color_tolerance=color_tolerance)
+    return svgs
+
+
+def get_png(width, height, params={}, color_tolerance=0, stats=None):
+    """Renders the image directly to PNG, without going through SVG"""
+    params = get_parameters(width, height, params, stats=stats)
+    polygons = get_polygons(params, color_tolerance)
 
+    if stats is None:
+        return raster.rasterize(width, height, polygons).get_png()
 
-def get_svg(width, height, params={}):
-    return "".join(get_svg_iter(width, height, params))
+    with stats.stage("serialize"):
+        return raster.rasterize(width, height, polygons).get_png()
+
+
+def get_svg_chunks(width, height, params={}, chunk_size=64 * 1024,
+                   compact=False, stats=None, window=None):
+    """Like get_svg_iter, but combines elements into chunks of at least
+    chunk_size characters (except for the last one)."""
+    chunk = []
+    length = 0
+    for element in get_svg_iter(width, height, params, compact=compact,
+                                stats=stats, window=window):
+        chunk.append(element)
+        length += len(element)
+        if length >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+
+    if chunk:
+        yield "".join(chunk)
 
 
 def cmdline():
     import argparse
+    import sys
 
-    parser = argparse.ArgumentParser(description='Generate an svg wallpaper')
+    parser = argparse.ArgumentParser(description='Generate a wallpaper')
     parser.add_argument('--width', type=int, default=1024,
                         help='The width of the wallpaper')
     parser.add_argument('--height', type=int, default=786,
@@ -59,12 +288,96 @@ def cmdline():
     parser.add_argument('--log-choices',
                         help='Log the choices made', action='store_true')
 
-    parser.add_argument('--output', type=argparse.FileType('w'),
-                        default='-')
+    parser.add_argument('--format', choices=['svg', 'svgz', 'png'],
+                        default='svg',
+                        help='The file format to produce')
+
+    parser.add_argument('--compact', action='store_true',
+                        help='Produce smaller SVG files')
+
+    parser.add_argument('--color-tolerance', type=float, default=0,
+                        help='Reuse colors within cells of this many pixels')
+
+    parser.add_argument('--stats', action='store_true',
+                        help='Print render statistics to stderr')
+
+    parser.add_argument('--quality', default='exact',
+                        choices=sorted(parameters.QUALITY_LEVELS),
+                        help='Level of detail; only exact renders every '
+                             'detail')
+    parser.add_argument('--max-polygons', type=int,
+                        help='Use larger tiles to stay below this many '
+                             'polygons')
+
+    parser.add_argument('--output', default='-')
+
+    parser.add_argument('--batch', type=argparse.FileType('r'),
+                        help='Render an image for every seed in this file')
+    parser.add_argument('--jobs', type=int,
+                        help='Number of processes to use')
+    parser.add_argument('--outdir', default='.',
+                        help='Directory to write --batch images to')
 
     args = parser.parse_args()
 
-    for element in get_svg_iter(args.width, args.height,
-                                {"seed": args.seed},
-                                log_choices=args.log_choices):
-        args.output.write(element)
+    params = {"seed": args.seed, "quality": args.quality,
+              "max_polygons": args.max_polygons}
+
+    if args.batch:
+        from . import batch
+
+        settings = {key: value for key, value in params.items()
+                    if key != "seed" and value is not None}
+        result = batch.render_batch(batch.read_seeds(args.batch),
+                                    args.width, args.height, args.outdir,
+                                    jobs=args.jobs, fmt=args.format,
+                                    params=settings, compact=args.compact,
+                                    color_tolerance=args.color_tolerance)
+        sys.stderr.write("%s\n" % result)
+        return
+
+    if args.jobs and not args.log_choices and not args.stats:
+        from . import parallel
+
+        if args.format == 'png':
+            data = parallel.get_png(args.width, args.height, params,
+                                    color_tolerance=args.color_tolerance,
+                                    jobs=args.jobs)
+            argparse.FileType('wb')(args.output).write(data)
+        else:
+            data = parallel.get_svg(args.width, args.height, params,
+                                    compact=args.compact,
+                                    color_tolerance=args.color_tolerance,
+                                    jobs=args.jobs)
+            if args.format == 'svgz':
+                argparse.FileType('wb')(args.output).write(
+                    compression.compress(data, "gzip"))
+            else:
+                argparse.FileType('w')(args.output).write(data)
+        return
+
+    stats = render_stats.RenderStats() if args.stats else None
+
+    if args.format == 'png':
+        output = argparse.FileType('wb')(args.output)
+        output.write(get_png(args.width, args.height, params,
+                             color_tolerance=args.color_tolerance,
+                             stats=stats))
+    else:
+        elements = get_svg_iter(args.width, args.height, params,
+                                log_choices=args.log_choices,
+                                compact=args.compact,
+                                color_tolerance=args.color_tolerance,
+                                stats=stats)
+
+        if args.format == 'svgz':
+            output = argparse.FileType('wb')(args.output)
+            elements = compression.compress_chunks(elements, "gzip")
+        else:
+            output = argparse.FileType('w')(args.output)
+
+        for element in elements:
+            output.write(element)
+
+    if stats is not None:
+        sys.stderr.write("%s\n" % stats)
@@ -1,46 +1,113 @@
-import zlib
-import math
+# cython: language_level=3
+from libc.math cimport floor, fmod
+from libc.stdlib cimport malloc, free
 
 cdef extern from "zlib.h":
-    unsigned long crc32(unsigned long crc, 
+    unsigned long crc32(unsigned long crc,
                         const unsigned char *buf,
                         unsigned int len)
 
-cdef unsigned long MAX_VALUE = 0x3FFFFFFF  # Ignore first two bits - they are insufficienly random
-cdef float INV_MAX_VALUE = 1.0 / float(MAX_VALUE)
+cdef unsigned long long MAX_VALUE = 0x3FFFFFFF  # Ignore first two bits - they are insufficienly random
+cdef double INV_MAX_VALUE = 1.0 / MAX_VALUE
 
+# Everything below mirrors the pure python implementation in parameters.py,
+# operation for operation, so both produce identical results.
 
 
-cdef float perlin_random(unsigned long seed, long  x,  long y):
-    cdef unsigned long value
-    value = crc32((seed ^ y) * x, b"x", 1)
+cdef inline double perlin_random(unsigned long long seed,
+                                 long long x, long long y):
+    cdef unsigned long long value
+    # Python hashes with an unbounded product, but crc32 only uses the
+    # lower 32 bits of it, which survive the wrap-around.
+    value = (seed ^ <unsigned long long> y) * <unsigned long long> x
+    value = crc32(value & 0xFFFFFFFF, b"x", 1)
 
-    value = value & MAX_VALUE
-    return float(value)
+    return <double> (value & MAX_VALUE)
 
-def get_octave(unsigned long seed, complex coord):
-    cdef float x, y, offsetx, offsety, 
-    cdef float value00, value10, value01, value11
-    cdef float value0, value1, result
-    cdef int cellx, celly
 
-    x = coord.real
-    y = coord.imag
+cdef inline double mod1(double x):
+    # Python's float modulo, which differs from fmod for negative numbers
+    cdef double result = fmod(x, 1.0)
+    if result < 0:
+        result += 1.0
+    elif result == 0:
+        result = 0.0
+    return result
 
-    cellx = int(x)
-    celly = int(y)
 
-    value00 = perlin_random(seed, cellx,     celly)
+cdef double octave(unsigned long long seed, double x, double y):
+    cdef double offsetx, offsety
+    cdef double value00, value10, value01, value11
+    cdef double value0, value1, result
+    cdef long long cellx, celly
+
+    cellx = <long long> floor(x)
+    celly = <long long> floor(y)
+
+    value00 = perlin_random(seed, cellx, celly)
     value10 = perlin_random(seed, cellx + 1, celly)
-    value01 = perlin_random(seed, cellx,     celly + 1)
+    value01 = perlin_random(seed, cellx, celly + 1)
     value11 = perlin_random(seed, cellx + 1, celly + 1)
 
-    offsetx = x % 1.0
-    offsety = y % 1.0
+    offsetx = mod1(x)
+    offsety = mod1(y)
 
-    value0 = offsetx * value10 + (1.0 - offsetx) * value00
-    value1 = offsetx * value11 + (1.0 - offsetx) * value01
+    value0 = offsetx * value10 + (1 - offsetx) * value00
+    value1 = offsetx * value11 + (1 - offsetx) * value01
 
-    result = offsety * value1 + (1.0 - offsety) * value0
+    result = offsety * value1 + (1 - offsety) * value0
 
     return result * INV_MAX_VALUE
+
+
+def get_octave(unsigned long long seed, complex coord):
+    return octave(seed, coord.real, coord.imag)
+
+
+cdef class PerlinSampler:
+    """Evaluates all octaves of a PerlinNoise in one call"""
+
+    cdef int count
+    cdef double *scales
+    cdef double *inv_scales
+    cdef unsigned long long *seeds
+    cdef double inv_size, min_value, max_value
+
+    def __cinit__(self, octaves, double inv_size,
+                  double min_value, double max_value):
+        self.count = len(octaves)
+        self.scales = <double *> malloc(self.count * sizeof(double))
+        self.inv_scales = <double *> malloc(self.count * sizeof(double))
+        self.seeds = <unsigned long long *> malloc(
+            self.count * sizeof(unsigned long long))
+        if not self.scales or not self.inv_scales or not self.seeds:
+            raise MemoryError()
+
+        for idx, (scale, inv_scale, seed) in enumerate(octaves):
+            self.scales[idx] = scale
+            self.inv_scales[idx] = inv_scale
+            self.seeds[idx] = seed
+
+        self.inv_size = inv_size
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def __dealloc__(self):
+        free(self.scales)
+        free(self.inv_scales)
+        free(self.seeds)
+
+    def __call__(self, complex coord):
+        cdef double x = coord.real * self.inv_size
+        cdef double y = coord.imag * self.inv_size
+        cdef double value = 0
+        cdef int idx
+
+        for idx in range(self.count):
+            value += octave(self.seeds[idx],
+                            x * self.inv_scales[idx],
+                            y * self.inv_scales[idx]) * self.scales[idx]
+
+        # Interpolate between min and max value
+        return (value * self.max_value +
+                (1 - value) * self.min_value)
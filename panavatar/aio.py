@@ -0,0 +1,72 @@
+"""Rendering from asyncio code, without blocking the event loop.
+
+get_svg_aiter renders on the event loop itself, but regularly gives other
+tasks a chance to run. AsyncRenderer moves rendering to an executor, and
+limits how many renders run at the same time.
+"""
+
+import asyncio
+import functools
+
+from . import get_svg, get_svg_chunks, get_svg_iter
+
+
+async def get_svg_aiter(width, height, params={}, batch_size=64, **kwargs):
+    """Async version of get_svg_iter, which yields to the event loop after
+    every batch_size elements. Accepts the same keyword arguments.
+
+    Tiles are deformed in batches as rendering progresses, so this also
+    yields during deformation. Laying out the tiles is done up front though
+    (about 40ms for a 4K image); use AsyncRenderer to avoid that blocking
+    the event loop."""
+    count = 0
+    for element in get_svg_iter(width, height, params, **kwargs):
+        yield element
+
+        count += 1
+        if count % batch_size == 0:
+            await asyncio.sleep(0)
+
+
+class AsyncRenderer(object):
+    """Renders in an executor, running at most max_renders at once.
+
+    executor defaults to the event loop's default executor. iter_svg and
+    iterate need a thread based executor, as they resume a generator; run
+    and get_svg also work with a process pool."""
+
+    def __init__(self, executor=None, max_renders=4):
+        self.executor = executor
+        self.semaphore = asyncio.Semaphore(max_renders)
+
+    async def run(self, func, *args, **kwargs):
+        """Calls func in the executor, once a render slot is available"""
+        loop = asyncio.get_event_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get_svg(self, width, height, params={}, **kwargs):
+        return await self.run(get_svg, width, height, params, **kwargs)
+
+    async def iter_svg(self, width, height, params={}, chunk_size=64 * 1024,
+                       **kwargs):
+        """Yields chunks of the image, as get_svg_chunks does"""
+        chunks = get_svg_chunks(width, height, params, chunk_size, **kwargs)
+        async for chunk in self.iterate(chunks):
+            yield chunk
+
+    async def iterate(self, iterable):
+        """Passes through a (rendering) iterable, producing every item in the
+        executor. Holds a render slot until the iterable is exhausted."""
+        loop = asyncio.get_event_loop()
+        iterator = iter(iterable)
+        done = object()
+
+        async with self.semaphore:
+            while True:
+                item = await loop.run_in_executor(self.executor,
+                                                  next, iterator, done)
+                if item is done:
+                    return
+                yield item
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import tempfile
+import time
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+
+def get_filename(seed, fmt="svg"):
+    """Returns a filesystem safe filename for the image of a seed"""
+    return "%s.%s" % (quote(seed, safe=""), fmt)
+
+
+def write_atomic(path, data):
+    """Writes data to path, such that path either doesn't exist, or holds
+    all of data; even if we're interrupted halfway."""
+    directory = os.path.dirname(path) or "."
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as output:
+            output.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def render_file(task):
+    from . import get_svg, get_svgz, get_png
+
+    seed, width, height, fmt, path, params, compact, color_tolerance = task
+
+    params = dict(params)
+    params["seed"] = seed
+
+    if fmt == "png":
+        data = get_png(width, height, params,
+                       color_tolerance=color_tolerance)
+    elif fmt == "svgz":
+        data = get_svgz(width, height, params, compact=compact,
+                        color_tolerance=color_tolerance)
+    else:
+        data = get_svg(width, height, params, compact=compact,
+                       color_tolerance=color_tolerance).encode("utf-8")
+
+    write_atomic(path, data)
+    return path
+
+
+class BatchResult(object):
+    def __init__(self, rendered, skipped, duration):
+        self.rendered = rendered
+        self.skipped = skipped
+        self.duration = duration
+
+    @property
+    def renders_per_second(self):
+        if not self.duration:
+            return 0.0
+        return self.rendered / self.duration
+
+    def __str__(self):
+        return ("Rendered %i images in %.1fs (%.1f renders/s), "
+                "skipped %i existing" % (self.rendered, self.duration,
+                                         self.renders_per_second,
+                                         self.skipped))
+
+
+def render_batch(seeds, width, height, outdir, jobs=None, fmt="svg",
+                 chunksize=None, params={}, compact=False, color_tolerance=0):
+    """Renders an image for every seed into outdir, using a pool of jobs
+    processes (defaults to the number of cpus). params (without seed),
+    compact and color_tolerance are passed on to every render, as for
+    get_svg.
+
+    Images which already exist are skipped, so an interrupted batch can be
+    resumed by running it again."""
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    tasks = []
+    skipped = 0
+    for seed in seeds:
+        path = os.path.join(outdir, get_filename(seed, fmt))
+        if os.path.exists(path):
+            skipped += 1
+        else:
+            tasks.append((seed, width, height, fmt, path, params, compact,
+                          color_tolerance))
+
+    jobs = jobs or multiprocessing.cpu_count()
+    if chunksize is None:
+        # A few chunks per worker balances the load, without spending too
+        # much time on communication.
+        chunksize = max(1, len(tasks) // (jobs * 4))
+
+    start = time.time()
+    rendered = 0
+
+    if tasks:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for _ in pool.imap_unordered(render_file, tasks, chunksize):
+                rendered += 1
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return BatchResult(rendered, skipped, time.time() - start)
+
+
+def read_seeds(seed_file):
+    """Reads one seed per line, ignoring empty lines"""
+    return [line.strip() for line in seed_file if line.strip()]
@@ -0,0 +1,379 @@
+import collections
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def get_cache_key(width, height, params, variant="svg"):
+    """Builds a key which is identical for renders producing identical images.
+
+    Parameters are canonicalized by sorting them, and the result is hashed
+    so the key is safe to use with any cache backend. variant distinguishes
+    different encodings of the same image."""
+    from . import __version__
+
+    canonical = repr((__version__, variant, int(width), int(height),
+                      sorted((str(key), str(value))
+                             for key, value in params.items())))
+    digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+    return "panavatar:%s" % digest
+
+
+def get_fingerprint(width, height, params, variant="svg"):
+    """Like get_cache_key, but computed from the decisions the parameters
+    resolve to, so parameters producing the same image (for example choices
+    in different case) get the same fingerprint.
+
+    Only the choices made before rendering are resolved, other parameters
+    are included as given. params needs a fixed seed."""
+    from . import __version__, get_parameters, resolve_decisions
+
+    params = get_parameters(width, height, params)
+    resolve_decisions(params)
+
+    overridden = getattr(params, "overridden", {})
+    overrides = sorted((str(key), repr(overridden[key]) if key in overridden
+                        else str(value))
+                       for key, value in getattr(params, "values", {}).items())
+
+    canonical = repr((__version__, variant, int(width), int(height),
+                      params.seed, params.quality, params.max_polygons,
+                      params.deform_version, overrides))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class RenderCache(object):
+    """Base class for render caches. Keeps track of hits and misses."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def get_or_render(self, key, render):
+        """Returns the cached value for key, or calls render to produce it."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = render()
+        self.set(key, value)
+        return value
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache(RenderCache):
+    """An in-process cache, evicting the least recently used renders once
+    their combined size exceeds max_bytes."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        super(MemoryCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return None
+
+            # Re-insert to mark it as most recently used.
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            old_value = self.entries.pop(key, None)
+            if old_value is not None:
+                self.size -= len(old_value)
+
+            self.entries[key] = value
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    @property
+    def stats(self):
+        stats = super(MemoryCache, self).stats
+        stats.update(entries=len(self.entries), bytes=self.size)
+        return stats
+
+
+class DjangoCache(RenderCache):
+    """Stores renders in one of the caches configured in django's CACHES
+    setting. Renders larger than max_bytes are not stored."""
+
+    def __init__(self, alias="default", timeout=None, max_bytes=None):
+        super(DjangoCache, self).__init__()
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+
+        self.cache.set(key, value, self.timeout)
+
+
+class DiskCache(RenderCache):
+    """Stores renders in a directory, which can be shared by any number of
+    processes, and survives restarts.
+
+    Renders (text or bytes) are appended to a pack file, and their key
+    digest and location to an index file. Hits are read through mmap, so
+    processes share the pages in the OS page cache. Writers take a lock on
+    the directory.
+
+    Once the pack would grow beyond max_bytes, the most recently stored
+    renders (up to half of max_bytes) are copied to a new pack, and the old
+    pack is removed. Without fcntl (on Windows), there's no locking, so only
+    one process may use the directory."""
+
+    # key digest, offset, length, and whether the value is text
+    RECORD = struct.Struct("<20sQI?")
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        super(DiskCache, self).__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        self.current = None  # Identity of the current generation file
+        self.generation = None
+        self.entries = {}  # key digest -> (offset, length, is_text)
+        self.index_pos = 0
+        self.pack = None
+        self.map = None
+
+    def get_filename(self, name, generation=None):
+        if generation is not None:
+            name = "%s.%i" % (name, generation)
+        return os.path.join(self.path, name)
+
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.get_filename("lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        """Loads the current generation, and new index records. Returns
+        False if the store is empty."""
+        try:
+            stat = os.stat(self.get_filename("current"))
+        except OSError:
+            return False
+
+        current = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if current != self.current:
+            with open(self.get_filename("current")) as current_file:
+                generation = int(current_file.read())
+
+            if generation != self.generation:
+                self.close()
+                self.pack = open(self.get_filename("pack", generation), "rb")
+                self.generation = generation
+            self.current = current
+
+        with open(self.get_filename("index", self.generation), "rb") as index:
+            index.seek(self.index_pos)
+            data = index.read()
+
+        # Skip a partially written record, it is completed (or truncated by
+        # the next writer) later.
+        size = self.RECORD.size
+        for pos in range(0, len(data) - size + 1, size):
+            digest, offset, length, is_text = \
+                self.RECORD.unpack_from(data, pos)
+            self.entries[digest] = (offset, length, is_text)
+            self.index_pos += size
+
+        return True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.pack is not None:
+            self.pack.close()
+
+        self.generation = None
+        self.entries = {}
+        self.index_pos = 0
+        self.pack = None
+        self.map = None
+
+    def read(self, offset, length):
+        if self.map is None or len(self.map) < offset + length:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.pack.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def get(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+
+        with self.lock:
+            try:
+                if not self.refresh():
+                    return None
+            except (OSError, ValueError):
+                # Removed by a compaction in another process, just now.
+                self.current = None
+                return None
+
+            try:
+                offset, length, is_text = self.entries[digest]
+            except KeyError:
+                return None
+
+            value = self.read(offset, length)
+            return value.decode('utf-8') if is_text else value
+
+    def set(self, key, value):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        is_text = not isinstance(value, bytes)
+        data = value.encode('utf-8') if is_text else value
+        if not data or len(data) > self.max_bytes // 2:
+            return
+
+        with self.lock, self.locked():
+            if not self.refresh():
+                self.write_generation(0, [])
+                self.refresh()
+
+            if digest in self.entries:
+                return  # Stored by another process
+
+            end = os.path.getsize(self.get_filename("pack", self.generation))
+            if end + len(data) > self.max_bytes:
+                self.compact(len(data))
+                end = os.path.getsize(
+                    self.get_filename("pack", self.generation))
+
+            with open(self.get_filename("pack", self.generation), "ab") as pack:
+                pack.write(data)
+
+            # The data is written before the index record, so readers never
+            # find a record pointing to incomplete data.
+            with open(self.get_filename("index", self.generation),
+                      "r+b") as index:
+                index.seek(0, os.SEEK_END)
+                index.truncate(index.tell() -
+                               index.tell() % self.RECORD.size)
+                index.write(self.RECORD.pack(digest, end, len(data),
+                                             is_text))
+
+            self.refresh()
+
+    def compact(self, reserve):
+        """Starts a new generation with the most recent renders, leaving
+        room for reserve bytes."""
+        budget = self.max_bytes // 2 - reserve
+        kept = []
+        for digest, (offset, length, is_text) in reversed(
+                list(self.entries.items())):
+            if length > budget:
+                break
+            budget -= length
+            kept.append((digest, self.read(offset, length), is_text))
+
+        old_generation = self.generation
+        self.write_generation(old_generation + 1, reversed(kept))
+        self.refresh()
+
+        for name in ("pack", "index"):
+            os.remove(self.get_filename(name, old_generation))
+
+    def write_generation(self, generation, entries):
+        """Writes a pack and index with (key digest, data, is_text) tuples,
+        and makes it the current generation."""
+        offset = 0
+        with open(self.get_filename("pack", generation), "wb") as pack, \
+                open(self.get_filename("index", generation), "wb") as index:
+            for digest, data, is_text in entries:
+                pack.write(data)
+                index.write(self.RECORD.pack(digest, offset, len(data),
+                                             is_text))
+                offset += len(data)
+
+        temp_name = self.get_filename("current.tmp")
+        with open(temp_name, "w") as current_file:
+            current_file.write(str(generation))
+        os.replace(temp_name, self.get_filename("current"))
+
+    @property
+    def stats(self):
+        stats = super(DiskCache, self).stats
+        with self.lock:
+            try:
+                self.refresh()
+            except (OSError, ValueError):
+                self.current = None
+
+            size = 0
+            if self.pack is not None:
+                size = os.fstat(self.pack.fileno()).st_size
+            stats.update(entries=len(self.entries), bytes=size)
+        return stats
+
+
+BACKENDS = {
+    "memory": MemoryCache,
+    "django": DjangoCache,
+    "disk": DiskCache,
+}
+
+
+def create_cache(config):
+    """Creates a cache from a configuration dict, like:
+
+        {"BACKEND": "memory", "MAX_BYTES": 64 * 1024 * 1024}
+        {"BACKEND": "django", "ALIAS": "default", "TIMEOUT": 3600}
+        {"BACKEND": "disk", "PATH": "/var/cache/panavatar"}
+
+    BACKEND may also be a RenderCache subclass. Other keys are passed
+    (lowercased) to the backend's constructor."""
+    config = dict(config)
+    backend = config.pop("BACKEND", "memory")
+    if not isinstance(backend, type):
+        backend = BACKENDS[backend]
+
+    return backend(**dict((key.lower(), value)
+                          for key, value in config.items()))
@@ -1,18 +1,32 @@
 import colorsys
 
+# Color variations smaller than this can't change any RGB channel by more
+# than one step, even for hue, which moves channels six times as fast.
+MIN_VISIBLE_VARIATION = 1 / (6 * 256.)
+
+# Hex representations of all channel values
+HEX_CHANNELS = ["%02x" % value for value in range(256)]
+
 
 def to_rgb(hsv):
     """Converts a color from HSV to a hex RGB.
 
     HSV should be in range 0..1, though hue wraps around. Output is a 
     hexadecimal color value as used by CSS, HTML and SVG"""
-    r, g, b = [int(min(255, max(0, component * 256)))
-               for component in colorsys.hsv_to_rgb(*hsv)]
+    r, g, b = colorsys.hsv_to_rgb(*hsv)
+
+    return (HEX_CHANNELS[int(min(255, max(0, r * 256)))] +
+            HEX_CHANNELS[int(min(255, max(0, g * 256)))] +
+            HEX_CHANNELS[int(min(255, max(0, b * 256)))])
 
-    return "%02x%02x%02x" % (r, g, b)
 
+def get_color_scheme(params, tolerance=0):
+    """Returns a function mapping a coordinate and scheme index to a hex color.
 
-def get_color_scheme(params):
+    Every color filter varies the color by coordinate, so colors are computed
+    per polygon. With a tolerance, colors are computed once per square cell
+    of tolerance pixels (at its center), and reused for every coordinate in
+    that cell."""
     # Choose a basic scheme.
     base_scheme = params.weighted_choice([(75, Monochrome),
                                           (5, Complement),
@@ -28,7 +42,9 @@ def get_color_scheme(params):
                                           'color_filter')
 
     if "noise" in color_filter:
-        the_scheme = ColorNoise(params, the_scheme)
+        noise = ColorNoise(params, the_scheme)
+        if any(noise.samplers):
+            the_scheme = noise
 
     if "vignette" in color_filter:
         the_scheme = RadialDarken(params, the_scheme)
@@ -36,6 +52,23 @@ def get_color_scheme(params):
     if "radial_hue" in color_filter:
         the_scheme = RadialHue(params, the_scheme)
 
+    if tolerance:
+        cache = {}
+
+        def sample(coord, scheme=0):
+            key = (scheme,
+                   int(coord.real // tolerance),
+                   int(coord.imag // tolerance))
+            try:
+                return cache[key]
+            except KeyError:
+                center = (key[1] + .5 + (key[2] + .5) * 1j) * tolerance
+                color = cache[key] = to_rgb(the_scheme.color_at(center,
+                                                                scheme))
+                return color
+
+        return sample
+
     def sample(coord, scheme=0):
         return to_rgb(the_scheme.color_at(coord, scheme))
 
@@ -110,11 +143,17 @@ class ColorNoise:
                           min_value=-value, max_value=value, octaves=1),
         ]
 
+        if params.level_of_detail[2]:
+            self.samplers = [
+                sampler if variation >= MIN_VISIBLE_VARIATION else None
+                for sampler, variation
+                in zip(self.samplers, [hue, saturation, value])]
+
     def color_at(self, coord, scheme):
         base_color = self.parent.color_at(coord, scheme)
-        return (component + sampler(coord)
-                for (component, sampler)
-                in zip(base_color, self.samplers))
+        return tuple(
+            component + sampler(coord) if sampler is not None else component
+            for (component, sampler) in zip(base_color, self.samplers))
 
 
 class RadialDarken:
@@ -125,7 +164,7 @@ class RadialDarken:
         self.edge_amount = params.uniform("radial_darkness", .2, .7)
 
     def color_at(self, coord, scheme):
-        base_color = list(self.parent.color_at(coord, scheme))
+        base_color = self.parent.color_at(coord, scheme)
         distance = 2 * \
             abs(coord - (self.params.size / 2.0)) / abs(self.params.size)
 
@@ -144,7 +183,7 @@ class RadialHue:
         self.edge_amount = params.uniform("radial_darkness", .1, .5)
 
     def color_at(self, coord, scheme):
-        base_color = list(self.parent.color_at(coord, scheme))
+        base_color = self.parent.color_at(coord, scheme)
         distance = 2 * \
             abs(coord - (self.params.size / 2.0)) / abs(self.params.size)
 
@@ -0,0 +1,126 @@
+"""A compact SVG serialization, producing the same image in fewer bytes.
+
+- Coordinates are rounded relative to the image size, and paths use
+  relative line commands.
+- Colors are set once using the color property, which a stylesheet applies
+  to both fill and stroke. Consecutive polygons with the same color are
+  grouped, so the color is only written once.
+"""
+
+import math
+
+# Groups are only sent once complete, so limit their length to keep streaming.
+MAX_GROUP_SIZE = 64
+
+HEADER = ('<svg xmlns="http://www.w3.org/2000/svg" width="%i" height="%i">'
+          '<style>path{fill:currentColor;stroke:currentColor}</style>')
+
+WINDOW_HEADER = ('<svg xmlns="http://www.w3.org/2000/svg" width="%i" '
+                 'height="%i" viewBox="%i %i %i %i"><style>path{'
+                 'fill:currentColor;stroke:currentColor}</style>')
+
+
+def get_decimals(width, height):
+    """Returns the number of decimals needed to position points to within
+    1/5000th of the image size, but no more than two."""
+    size = max(width, height, 1)
+    return min(2, max(0, int(math.ceil(math.log10(5000.0 / size)))))
+
+
+def format_number(value, decimals):
+    """Formats a fixed point integer, dropping superfluous zeroes."""
+    if not decimals:
+        return str(value)
+
+    text = "%.*f" % (decimals, value / 10.0 ** decimals)
+    text = text.rstrip("0").rstrip(".")
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def join_numbers(numbers):
+    # Separators are only needed when the next number has no sign.
+    return "".join(number if number[0] == "-" or not idx else " " + number
+                   for idx, number in enumerate(numbers))
+
+
+def format_path(shape, decimals):
+    """Formats a closed path with a move to the first point, followed by
+    relative lines to the other points."""
+    factor = 10 ** decimals
+    points = [(int(round(coord.real * factor)), int(round(coord.imag * factor)))
+              for coord in shape]
+
+    # Deltas are taken between rounded points, so rounding errors don't
+    # accumulate along the path.
+    numbers = [points[0][0], points[0][1]]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        numbers.append(x1 - x0)
+        numbers.append(y1 - y0)
+
+    numbers = [format_number(number, decimals) for number in numbers]
+    return "M%sl%sz" % (join_numbers(numbers[:2]), join_numbers(numbers[2:]))
+
+
+def format_color(color):
+    """Shortens a 6 digit hex color to 3 digits, when possible"""
+    if color[0] == color[1] and color[2] == color[3] and color[4] == color[5]:
+        return color[0] + color[2] + color[4]
+    return color
+
+
+def get_header(width, height, window=None):
+    if window is None:
+        return HEADER % (width, height)
+
+    return WINDOW_HEADER % ((window[2], window[3]) + tuple(window))
+
+
+def get_elements(width, height, polygons, window=None):
+    """Yields the header and path elements for (shape, color) pairs"""
+    yield get_header(width, height, window)
+
+    if window is not None:
+        # Round relative to the size of what's shown.
+        width, height = window[2], window[3]
+
+    for element in group_paths(format_paths(width, height, polygons)):
+        yield element
+
+
+def format_paths(width, height, polygons):
+    """Formats the shapes of (shape, color) pairs, yielding (path, color)"""
+    decimals = get_decimals(width, height)
+
+    for shape, color in polygons:
+        yield format_path(shape, decimals), color
+
+
+def group_paths(paths):
+    """Yields elements for (path, color) pairs, grouping consecutive paths
+    with the same color."""
+    run_color = None
+    run = []
+    for path, color in paths:
+        if color != run_color or len(run) >= MAX_GROUP_SIZE:
+            if run:
+                yield format_run(run_color, run)
+            run_color = color
+            run = []
+
+        run.append(path)
+
+    if run:
+        yield format_run(run_color, run)
+
+
+def format_run(color, paths):
+    color = format_color(color)
+    if len(paths) == 1:
+        return '<path color="#%s" d="%s"/>' % (color, paths[0])
+
+    return '<g color="#%s">%s</g>' % (
+        color, "".join('<path d="%s"/>' % path for path in paths))
@@ -0,0 +1,77 @@
+"""Compressed output, produced while rendering.
+
+gzip is always available (it is also what .svgz files use). brotli is used
+when the brotli package is installed.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Supported encodings, in order of preference
+ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+class GzipCompressor(object):
+    def __init__(self, level=9):
+        # A gzip header, without timestamp, so output is reproducible
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+def get_compressor(encoding):
+    if encoding == "gzip":
+        return GzipCompressor()
+    if encoding == "br" and brotli is not None:
+        return brotli.Compressor()
+    raise ValueError("Unsupported encoding %r" % encoding)
+
+
+def compress_chunks(chunks, encoding):
+    """Compresses an iterable of strings, yielding compressed data as it
+    becomes available. The result doesn't depend on how the input is split
+    into chunks."""
+    compressor = get_compressor(encoding)
+
+    for chunk in chunks:
+        data = compressor.process(chunk.encode("utf-8"))
+        if data:
+            yield data
+
+    yield compressor.finish()
+
+
+def compress(text, encoding):
+    return b"".join(compress_chunks([text], encoding))
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """Returns the preferred encoding from encodings (ENCODINGS by default)
+    acceptable according to an Accept-Encoding header, or None."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].strip().lower()] = quality
+
+    for encoding in encodings or ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+
+    return None
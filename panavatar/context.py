@@ -0,0 +1,35 @@
+"""The inputs of a render, resolved once.
+
+A RenderContext is immutable, so it can be shared between threads, and be
+used for any number of renders, which all produce the same image. Every
+render gets its own parameters, preloaded with the decisions of the context,
+so they aren't hashed again.
+"""
+
+import collections
+
+
+class RenderContext(collections.namedtuple(
+        "RenderContext",
+        ["width", "height", "seed", "overrides", "random_values",
+         "noise_seeds"])):
+    """Create one with panavatar.get_context, and pass it instead of the
+    parameters dict to get_svg, get_svg_iter or get_png."""
+
+    __slots__ = ()
+
+    def get_params(self):
+        """Returns the parameters as a new dict, including the seed"""
+        params = dict(self.overrides)
+        params["seed"] = self.seed
+        return params
+
+    def get_parameters(self, log_choices=False, stats=None):
+        """Returns new parameters for a render of this context"""
+        from . import get_parameters
+
+        params = get_parameters(self.width, self.height, self.get_params(),
+                                log_choices, stats)
+        params.set_decisions({"random": self.random_values,
+                              "perlin": self.noise_seeds})
+        return params
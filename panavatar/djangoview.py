@@ -1,9 +1,19 @@
 import datetime
+import functools
+import logging
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         StreamingHttpResponse)
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.http import condition
 
-from . import get_svg
+from . import get_render_settings, get_svg, get_svg_chunks
+from . import cache
+from . import compression
+from . import stats as render_stats
+
+logger = logging.getLogger(__name__)
 
 # Add these url patterns the view to your project:
 #
@@ -12,9 +22,79 @@ from . import get_svg
 #     url(r'^(?P<height>\d+)x(?P<width>\d+)/(?P<seed>.+).svg$',
 #         djangoviews.generate_image_svg),
 #
+# Very large images can be served in windows, like map tiles, by adding
+# (before the previous pattern):
+#
+#     url(r'^(?P<width>\d+)x(?P<height>\d+)/(?P<seed>.+)/'
+#         r'(?P<x>\d+),(?P<y>\d+),'
+#         r'(?P<window_width>\d+)x(?P<window_height>\d+).svg$',
+#         djangoviews.generate_window_svg),
+#
+# Renders for fixed seeds can be cached by configuring PANAVATAR_CACHE in your
+# settings, for example:
+#
+#     PANAVATAR_CACHE = {"BACKEND": "memory", "MAX_BYTES": 64 * 1024 * 1024}
+#     PANAVATAR_CACHE = {"BACKEND": "django", "ALIAS": "default"}
+#     PANAVATAR_CACHE = {"BACKEND": "disk", "PATH": "/var/cache/panavatar"}
+#
+# To send the image while it is being rendered, rather than after, set
+# PANAVATAR_STREAMING = True. PANAVATAR_STREAMING_CHUNK_SIZE sets the size of
+# the chunks sent (in bytes, 64k by default).
+#
+# PANAVATAR_COMPACT = True produces smaller SVG files, see panavatar.compact.
+#
+# PANAVATAR_COMPRESS = True sends images compressed (with brotli or gzip,
+# whichever the client accepts), compressing while rendering. With a cache,
+# the compressed image is stored, so every image is compressed once per
+# encoding. Leave this off if your web server compresses responses already.
+#
+# PANAVATAR_STATS = True records where render time goes. The stage times are
+# sent in a Server-Timing header, all stats in an X-Panavatar-Stats header, and
+# they are logged to the panavatar.djangoview logger. Streamed responses only
+# log them, as the headers have been sent before rendering is done.
+#
+# Requests with an invalid quality, max_polygons or deform_version in the
+# query string are answered with a 400 Bad Request.
+#
+# Images for fixed seeds get an ETag, computed from the parameters without
+# rendering, so conditional requests are answered with a 304 cheaply.
+#
+# On ASGI servers, use generate_image_svg_async instead. It renders in a thread
+# pool, so the event loop isn't blocked, and runs at most
+# PANAVATAR_ASYNC_MAX_RENDERS (4 by default) renders at once. Streaming from an
+# async view needs Django 4.2 or later.
+
+
+_render_cache = None
+_async_renderer = None
+
+
+def get_render_cache():
+    """Returns the cache configured in settings.PANAVATAR_CACHE, or None"""
+    global _render_cache
+
+    if _render_cache is None:
+        config = getattr(settings, "PANAVATAR_CACHE", None)
+        if config:
+            _render_cache = cache.create_cache(config)
+
+    return _render_cache
+
 
+def get_async_renderer():
+    """Returns the renderer used by generate_image_svg_async"""
+    global _async_renderer
 
-def never_modified(request, width, height, seed=None):
+    if _async_renderer is None:
+        from . import aio
+
+        _async_renderer = aio.AsyncRenderer(max_renders=getattr(
+            settings, "PANAVATAR_ASYNC_MAX_RENDERS", 4))
+
+    return _async_renderer
+
+
+def never_modified(request, width, height, seed=None, **window):
     if seed:
         # Fixed seeds have all been defined in Y2K (arbirary)
         return datetime.datetime(2000, 1, 1, 0, 0)
@@ -23,17 +103,208 @@ def never_modified(request, width, height, seed=None):
     return datetime.datetime.now()
 
 
-@condition(last_modified_func=never_modified)
+def get_window(x=None, y=None, window_width=None, window_height=None):
+    """Converts the window arguments of a url to a window, or None"""
+    if x is None:
+        return None
+    return int(x), int(y), int(window_width), int(window_height)
+
+
+def get_encoding(request):
+    """Returns the encoding to compress the response with, or None"""
+    if not getattr(settings, "PANAVATAR_COMPRESS", False):
+        return None
+
+    return compression.choose_encoding(
+        request.META.get("HTTP_ACCEPT_ENCODING", ""))
+
+
+def get_variant(window=None, encoding=None):
+    variant = "compact-svg" if getattr(settings, "PANAVATAR_COMPACT",
+                                       False) else "svg"
+    if window is not None:
+        variant += "-window-%i,%i,%ix%i" % window
+    if encoding is not None:
+        variant += "-" + encoding
+    return variant
+
+
+def get_etag(request, width, height, seed=None, **window):
+    if not seed:
+        return None
+
+    parameters = dict(request.GET.items())
+    parameters['seed'] = seed
+
+    return _get_fingerprint(int(width), int(height),
+                            tuple(sorted(parameters.items())),
+                            get_variant(get_window(**window),
+                                        get_encoding(request)))
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_fingerprint(width, height, parameters, variant):
+    return cache.get_fingerprint(width, height, dict(parameters), variant)
+
+
+def validate_settings(view):
+    """Answers requests with invalid render settings (quality, max_polygons
+    or deform_version) with a 400, before the view or its ETag runs."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            get_render_settings(request.GET)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@validate_settings
+@condition(etag_func=get_etag, last_modified_func=never_modified)
 def generate_image_svg(request, width, height, seed=None):
-    width = int(width)
-    height = int(height)
+    return generate_response(request, int(width), int(height), seed)
+
 
+@validate_settings
+@condition(etag_func=get_etag, last_modified_func=never_modified)
+def generate_window_svg(request, width, height, seed, x, y, window_width,
+                        window_height):
+    """Renders the window at x, y of the image for seed, as an SVG of
+    window_width by window_height"""
+    return generate_response(request, int(width), int(height), seed,
+                             get_window(x, y, window_width, window_height))
+
+
+def generate_response(request, width, height, seed=None, window=None):
     parameters = dict(request.GET.items())
 
     if seed:
         parameters['seed'] = seed
 
-    response = HttpResponse(get_svg(width, height, parameters),
-                            content_type="image/svg+xml")
+    encoding = get_encoding(request)
+    render_cache = get_render_cache()
+
+    if not seed or render_cache is None:
+        # Random seeds produce a new image every time, so aren't cached.
+        response = render_response(width, height, parameters, window=window,
+                                   encoding=encoding)
+
+    else:
+        key = cache.get_cache_key(width, height, parameters,
+                                  get_variant(window, encoding))
+        svg = render_cache.get(key)
+        if svg is not None:
+            render_cache.hits += 1
+            response = HttpResponse(svg, content_type="image/svg+xml")
+            if encoding is not None:
+                response["Content-Encoding"] = encoding
+        else:
+            render_cache.misses += 1
+            response = render_response(width, height, parameters,
+                                       lambda svg: render_cache.set(key, svg),
+                                       window, encoding)
+
+    if getattr(settings, "PANAVATAR_COMPRESS", False):
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+async def generate_image_svg_async(request, width, height, seed=None):
+    """Async version of generate_image_svg"""
+    return await run_async(generate_image_svg, request, width=width,
+                           height=height, seed=seed)
+
+
+async def generate_window_svg_async(request, width, height, seed, x, y,
+                                    window_width, window_height):
+    """Async version of generate_window_svg"""
+    return await run_async(generate_window_svg, request, width=width,
+                           height=height, seed=seed, x=x, y=y,
+                           window_width=window_width,
+                           window_height=window_height)
+
+
+async def run_async(view, request, **kwargs):
+    renderer = get_async_renderer()
+    response = await renderer.run(view, request, **kwargs)
+
+    if response.streaming:
+        # Produce the remaining chunks in the executor as well.
+        response.streaming_content = renderer.iterate(
+            response.streaming_content)
 
     return response
+
+
+def render_response(width, height, parameters, store=None, window=None,
+                    encoding=None):
+    """Renders the image (or a window of it) into a response, compressed
+    with encoding if given. If store is provided, it is called with the
+    complete (compressed) image once rendering is done."""
+
+    compact = getattr(settings, "PANAVATAR_COMPACT", False)
+
+    stats = None
+    if getattr(settings, "PANAVATAR_STATS", False):
+        stats = render_stats.RenderStats()
+
+    if not getattr(settings, "PANAVATAR_STREAMING", False):
+        svg = get_svg(width, height, parameters, compact=compact,
+                      stats=stats, window=window)
+        if encoding is not None:
+            svg = compression.compress(svg, encoding)
+        if store is not None:
+            store(svg)
+        response = HttpResponse(svg, content_type="image/svg+xml")
+        if encoding is not None:
+            response["Content-Encoding"] = encoding
+
+        if stats is not None:
+            log_stats(width, height, stats)
+            response["Server-Timing"] = stats.get_server_timing()
+            response["X-Panavatar-Stats"] = str(stats)
+
+        return response
+
+    chunk_size = getattr(settings, "PANAVATAR_STREAMING_CHUNK_SIZE",
+                         64 * 1024)
+    chunks = get_svg_chunks(width, height, parameters, chunk_size,
+                            compact=compact, stats=stats, window=window)
+    if encoding is not None:
+        chunks = compression.compress_chunks(chunks, encoding)
+    if store is not None:
+        chunks = _store_chunks(chunks, store)
+    if stats is not None:
+        chunks = _log_chunks(chunks, width, height, stats)
+
+    response = StreamingHttpResponse(chunks, content_type="image/svg+xml")
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+def log_stats(width, height, stats):
+    logger.info("Rendered %ix%i: %s", width, height, stats,
+                extra={"panavatar_stats": stats.as_dict()})
+
+
+def _log_chunks(chunks, width, height, stats):
+    for chunk in chunks:
+        yield chunk
+
+    log_stats(width, height, stats)
+
+
+def _store_chunks(chunks, store):
+    # Passes chunks through, and stores the result once complete. Aborted
+    # responses are never stored.
+    rendered = []
+    for chunk in chunks:
+        rendered.append(chunk)
+        yield chunk
+
+    if rendered:
+        store(rendered[0][:0].join(rendered))  # Text, or compressed bytes
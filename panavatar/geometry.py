@@ -2,8 +2,13 @@ import math
 
 from . import patterns
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def get_geometry(params):
+
+def get_deformations(params):
     deformations = []
     if params.uniform('have_crumple') > .3:
         deformations.append(deform_crumple(params))
@@ -14,17 +19,194 @@ def get_geometry(params):
     if params.uniform('have_zoom') > .5:
         deformations.append(deform_zoom(params))
 
-    if deformations:
-        combined_deformation = deformations[0]
-        # for deformation in deformations[1:]:
-        #     combined_deformation = lambda coord: deformation(combined_deformation(coord))
+    return deformations
+
+
+def get_deformation(params):
+    """Returns a single deformation applying all selected deformations, or
+    None when there is nothing to deform."""
+    deformations = get_deformations(params)
+
+    if not deformations:
+        return None
+
+    if len(deformations) == 1:
+        return deformations[0]
+
+    if params.deform_version == 1:
+        return deformations[0]
+
+    return compose(deformations)
+
+
+def get_geometry(params):
+    deformation = get_deformation(params)
+
+    tiles = patterns.get_tiles(params, deformation.max_offset
+                               if deformation is not None else no_offset)
+
+    if params.stats is not None:
+        tiles = params.stats.timed("tiles", tiles)
+        if deformation is not None:
+            deformation = instrument_deformation(params.stats, deformation)
+
+    if deformation is None:
+        return tiles
+
+    return _deform_shared(deformation, tiles)
+
+
+def _deform_shared(deformation, tiles):
+    # Neighbouring tiles share most of their vertices, so remember deformed
+    # vertices rather than deforming each copy.
+    deformed = {}
 
-        return (([combined_deformation(coord) for coord in shape], color_index)
-                for (shape, color_index)
-                in patterns.get_tiles(params))
+    for shape, color_index in tiles:
+        new_shape = []
+        for coord in shape:
+            try:
+                new_shape.append(deformed[coord])
+            except KeyError:
+                new_coord = deformed[coord] = deformation(coord)
+                new_shape.append(new_coord)
 
+        yield new_shape, color_index
+
+
+def get_geometry_arrays(params):
+    """Like get_geometry, but yields (n_tiles, n_vertices) arrays of shapes
+    sharing a color index. Requires numpy."""
+    deformation = get_deformation(params)
+    pattern = patterns.get_pattern(params)
+
+    if deformation is None:
+        tiles = pattern.generate_tile_arrays(max_offset=no_offset)
+        if params.stats is not None:
+            tiles = params.stats.timed("tiles", tiles)
+        return tiles
+
+    if params.stats is not None:
+        deformation = instrument_deformation(params.stats, deformation)
+
+    return _deform_indexed(params, pattern, deformation)
+
+
+def _deform_indexed(params, pattern, deformation, batch_size=1024):
+    # Deform every unique vertex once, then look up the tiles' vertices.
+    # Tiles are yielded in batches of batch_size, deforming the vertices
+    # they need as they go, so deformation is spread over the render rather
+    # than done up front (which lets get_svg_aiter yield in between).
+    if params.stats is None:
+        vertices, tiles = pattern.generate_indexed_tiles(
+            max_offset=deformation.max_offset)
     else:
-        return patterns.get_tiles(params)
+        with params.stats.stage("tiles"):
+            vertices, tiles = pattern.generate_indexed_tiles(
+                max_offset=deformation.max_offset)
+
+    deformed = numpy.empty_like(vertices)
+    is_deformed = numpy.zeros(len(vertices), dtype=bool)
+
+    for indices, color_index in tiles:
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+
+            needed = numpy.unique(batch[~is_deformed[batch]])
+            if len(needed):
+                deformed[needed] = deformation.many(vertices[needed])
+                is_deformed[needed] = True
+
+            yield deformed[batch], color_index
+
+
+def get_visible_polygons(params):
+    """Yields (shape, centroid, color_index) for every polygon which may be
+    visible in the viewport. Uses the array pipeline if numpy is available,
+    both produce identical results."""
+    polygons = _get_visible_polygons(params)
+    if params.stats is not None:
+        polygons = params.stats.timed("cull", polygons)
+    return polygons
+
+
+def _get_visible_polygons(params):
+    view_min, view_max = params.viewport
+    stats = params.stats
+
+    if numpy is None:
+        for shape, color_index in get_geometry(params):
+            if stats is not None:
+                stats.counts["tiles_generated"] += 1
+
+            # Don't spend time om invisible polys
+            minc, maxc = get_bb(shape)
+            if maxc.real < view_min.real or maxc.imag < view_min.imag or \
+                    minc.real > view_max.real or minc.imag > view_max.imag:
+                if stats is not None:
+                    stats.counts["tiles_culled"] += 1
+                continue
+
+            yield shape, get_centroid(shape), color_index
+        return
+
+    for tiles, color_index in get_geometry_arrays(params):
+        minc, maxc = get_bbs(tiles)
+        visible = ~((maxc.real < view_min.real) |
+                    (maxc.imag < view_min.imag) |
+                    (minc.real > view_max.real) |
+                    (minc.imag > view_max.imag))
+        tiles = tiles[visible]
+
+        if stats is not None:
+            stats.counts["tiles_generated"] += len(visible)
+            stats.counts["tiles_culled"] += len(visible) - len(tiles)
+
+        for shape, centroid in zip(tiles.tolist(),
+                                   get_centroids(tiles).tolist()):
+            yield shape, centroid, color_index
+
+
+def no_offset(minc, maxc):
+    return 0
+
+
+def _deformation(deformation, deformation_many, max_offset):
+    # Deformations are callables transforming a single coordinate, with two
+    # attributes:
+    # - many: transforms an array of coordinates
+    # - max_offset: given a bounding box, returns how far any point in that
+    #               box may be moved, along either axis.
+    deformation.many = deformation_many
+    deformation.max_offset = max_offset
+    return deformation
+
+
+def compose(deformations):
+    """Combines deformations into one, applying them in order.
+
+    Array batches pass through each deformation in turn, so each step still
+    runs over the whole batch at once."""
+
+    def deform(coord):
+        for deformation in deformations:
+            coord = deformation(coord)
+        return coord
+
+    def deform_many(coords):
+        for deformation in deformations:
+            coords = deformation.many(coords)
+        return coords
+
+    def max_offset(minc, maxc):
+        # Each deformation can move points further out, so later ones need
+        # to consider a larger area.
+        total = 0
+        for deformation in deformations:
+            margin = total + total * 1J
+            total += deformation.max_offset(minc - margin, maxc + margin)
+        return total
+
+    return _deformation(deform, deform_many, max_offset)
 
 
 def deform_crumple(params):
@@ -41,9 +223,13 @@ def deform_crumple(params):
                             max_value=max_offset,
                             detail=params.detail)
 
-    return lambda coord: (coord +
-                          noise_x(coord) +
-                          noise_y(coord) * 1J)
+    return _deformation(lambda coord: (coord +
+                                       noise_x(coord) +
+                                       noise_y(coord) * 1J),
+                        lambda coords: (coords +
+                                        noise_x.evaluate_many(coords) +
+                                        noise_y.evaluate_many(coords) * 1J),
+                        lambda minc, maxc: max_offset)
 
 
 def deform_wave(params):
@@ -55,8 +241,12 @@ def deform_wave(params):
 
     direction = amplitude / rotation * 1J
 
-    return lambda coord: (coord +
-                          direction * math.sin((coord * rotation).real / wavelength))
+    return _deformation(
+        lambda coord: (coord +
+                       direction * math.sin((coord * rotation).real / wavelength)),
+        lambda coords: (coords +
+                        direction * numpy.sin((coords * rotation).real / wavelength)),
+        lambda minc, maxc: abs(direction))
 
 
 def deform_zoom(params):
@@ -67,12 +257,62 @@ def deform_zoom(params):
     def coord_at(coord):
         offset = coord - center
         distance = abs(offset)
+        if not distance:
+            return coord  # The center stays in place
+
         new_distance = ((distance / size) ** amount) * size
         offset /= distance
         offset *= new_distance
         return center + offset
 
-    return coord_at
+    def coords_at(coords):
+        # Works on the components, as numpy's complex abs, power and
+        # division round differently from Python's.
+        offset = coords - center
+        distance = numpy.hypot(offset.real, offset.imag)
+        new_distance = numpy.float_power(distance / size, amount) * size
+
+        # The center stays in place: its offset is 0, and doesn't change
+        # when divided by 1 instead.
+        distance[distance == 0] = 1
+        return center + ((offset.real / distance) * new_distance +
+                         1J * ((offset.imag / distance) * new_distance))
+
+    def max_offset(minc, maxc):
+        # Points are moved radially, from distance r to f(r). The farthest
+        # point from the center is one of the corners.
+        max_distance = max(abs(corner - center)
+                           for corner in (minc, maxc,
+                                          minc.real + maxc.imag * 1J,
+                                          maxc.real + minc.imag * 1J))
+        distances = [max_distance]
+
+        # f(r) - r has an extreme where its derivative is zero.
+        if amount != 1:
+            extreme = size * amount ** (1 / (1 - amount))
+            if extreme < max_distance:
+                distances.append(extreme)
+
+        return max(abs(((distance / size) ** amount) * size - distance)
+                   for distance in distances)
+
+    return _deformation(coord_at, coords_at, max_offset)
+
+
+def instrument_deformation(stats, deformation):
+    """Wraps a deformation to record its time and vertices in stats"""
+
+    def deform(coord):
+        stats.counts["vertices_deformed"] += 1
+        with stats.stage("deform"):
+            return deformation(coord)
+
+    def deform_many(coords):
+        stats.counts["vertices_deformed"] += coords.size
+        with stats.stage("deform"):
+            return deformation.many(coords)
+
+    return _deformation(deform, deform_many, deformation.max_offset)
 
 
 def get_centroid(shape):
@@ -82,3 +322,19 @@ def get_centroid(shape):
 def get_bb(shape):
     return (min(x.real for x in shape) + min(y.imag for y in shape) * 1J,
             max(x.real for x in shape) + max(y.imag for y in shape) * 1J)
+
+
+def get_centroids(tiles):
+    """Array version of get_centroid, for a (n_tiles, n_vertices) array"""
+    total = 0
+    for idx in range(tiles.shape[1]):
+        total = total + tiles[:, idx]
+
+    count = tiles.shape[1]
+    return total.real / count + 1J * (total.imag / count)
+
+
+def get_bbs(tiles):
+    """Array version of get_bb, for a (n_tiles, n_vertices) array"""
+    return (tiles.real.min(axis=1) + tiles.imag.min(axis=1) * 1J,
+            tiles.real.max(axis=1) + tiles.imag.max(axis=1) * 1J)
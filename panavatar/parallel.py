@@ -0,0 +1,91 @@
+"""Renders a single image on multiple processes.
+
+The tile lattice is split into parts: strips of lattice columns for each
+shape in the pattern. Workers each render some parts, and the results are
+concatenated in part order, which is the order the serial renderer produces
+polygons in. Everything is derived from the parameters by hashing, so the
+result is identical to a serial render.
+"""
+
+import multiprocessing
+import time
+
+from . import context
+from . import patterns
+
+
+def _get_params(width, height, params):
+    from . import get_parameters
+    return get_parameters(width, height, params)
+
+
+def render_part(task):
+    from . import get_polygons, format_elements
+    from . import compact as compact_svg
+
+    width, height, params, fmt, color_tolerance, part = task
+
+    render_params = _get_params(width, height, params)
+    render_params.lattice_part = part
+    polygons = get_polygons(render_params, color_tolerance)
+
+    if fmt == "compact-svg":
+        return list(compact_svg.format_paths(width, height, polygons))
+    if fmt == "svg":
+        return list(format_elements(polygons))
+    return list(polygons)
+
+
+def render_parts(width, height, params, fmt, color_tolerance=0, jobs=None,
+                 strips=None):
+    """Returns the polygons (in the given format) of every part, in order"""
+    if not isinstance(params, context.RenderContext):
+        params = dict(params)
+        if not params.get("seed"):
+            # Every worker needs to make the same random choices.
+            params["seed"] = "%.1f" % time.time()
+
+    jobs = jobs or multiprocessing.cpu_count()
+    pattern = patterns.get_pattern(_get_params(width, height, params))
+    tasks = [(width, height, params, fmt, color_tolerance, part)
+             for part in pattern.get_parts(strips or jobs)]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(render_part, tasks, chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return [item for result in results for item in result]
+
+
+def get_svg(width, height, params={}, compact=False, color_tolerance=0,
+            jobs=None, strips=None):
+    """Like panavatar.get_svg, but renders on jobs processes (defaults to the
+    number of cpus). strips sets the number of strips each pattern shape is
+    split in, which defaults to the number of jobs."""
+    from . import get_header
+    from . import compact as compact_svg
+
+    if compact:
+        paths = render_parts(width, height, params, "compact-svg",
+                             color_tolerance, jobs, strips)
+        return "".join([compact_svg.HEADER % (width, height)] +
+                       list(compact_svg.group_paths(paths)) +
+                       ["</svg>"])
+
+    elements = render_parts(width, height, params, "svg",
+                            color_tolerance, jobs, strips)
+    return "".join([get_header(width, height)] + elements + ["</svg>"])
+
+
+def get_png(width, height, params={}, color_tolerance=0, jobs=None,
+            strips=None):
+    """Like panavatar.get_png, but generates polygons on jobs processes.
+    Polygons are rasterized in the main process, as their order matters."""
+    from . import raster
+
+    polygons = render_parts(width, height, params, "polygons",
+                            color_tolerance, jobs, strips)
+    return raster.rasterize(width, height, polygons).get_png()
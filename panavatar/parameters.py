@@ -2,10 +2,33 @@ import zlib
 import math
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 MAX_VALUE = 0x3FFFFFFF  # Ignore first two bits - they are insufficienly random
 INV_MAX_VALUE = 1.0 / MAX_VALUE
 
+# The maximum number of lattice cells a PerlinNoise keeps in tables. Scalar
+# lookups use about 150 bytes per cell, array lookups 8.
+MAX_TABLE_CELLS = 64 * 1024
+
+# Level of detail settings by quality: the smallest noise octave and the
+# smallest tile to render (in pixels), and whether to skip color variations
+# too small to be seen. Only "exact" renders images identical to previous
+# versions.
+QUALITY_LEVELS = {
+    "exact": (0, 0, False),
+    "balanced": (2, 2, True),
+    "preview": (8, 8, True),
+}
+
+# Noise lattice tables cover the image, plus this fraction of its size on
+# every side, for tiles reaching outside of it.
+TABLE_MARGIN = .5
+
 
 class RandomParameters(object):
     """A source of all-random parameters.
@@ -35,27 +58,81 @@ class RandomParameters(object):
         # Default, typically overridden
         self.size = 1024 + 786j
 
+        # A stats.RenderStats, if the render is instrumented
+        self.stats = None
+
+        # When rendering in parts, the part of the tile lattice to render.
+        # See TilingPattern.get_parts.
+        self.lattice_part = None
+
+        # When rendering a window of the image, its (top left, bottom right)
+        self.window = None
+
+        # One of QUALITY_LEVELS, and optionally the number of polygons to
+        # stay below.
+        self.quality = "exact"
+        self.max_polygons = None
+
+        # Before 0.4, only the first deformation was applied. Version 1
+        # restores that look.
+        self.deform_version = 2
+
+        # Random values and noise seeds by key, so every key is hashed once
+        self.decisions = {}
+        self.noise_seeds = {}
+
+    def get_decisions(self):
+        """Returns the random values used so far. Passing them to
+        set_decisions of another instance makes it reproduce them without
+        hashing."""
+        return {"random": dict(self.decisions),
+                "perlin": dict(self.noise_seeds)}
+
+    def set_decisions(self, decisions):
+        self.decisions.update(decisions.get("random", {}))
+        self.noise_seeds.update(decisions.get("perlin", {}))
+
     @property
     def img_scale(self):
         """A one-directional indication of the size of the image"""
         return min(400, abs(self.size))
 
+    @property
+    def viewport(self):
+        """The (top left, bottom right) corners of the area to render"""
+        if self.window is not None:
+            return self.window
+        return 0j, self.size
+
+    @property
+    def level_of_detail(self):
+        """(minimal octave size, minimal tile size, skip invisible colors)"""
+        return QUALITY_LEVELS[self.quality]
+
     @property
     def detail(self):
         """The size of the smallest detail"""
-        return self.uniform("detail",
-                            self.img_scale * .05,
-                            self.img_scale * .2)
+        detail = self.uniform("detail",
+                              self.img_scale * .05,
+                              self.img_scale * .2)
+
+        min_detail = self.level_of_detail[1]
+        if min_detail:
+            detail = max(detail, min_detail)
+        return detail
 
     def _random(self, key):
         """Generates a pseudorandom value between 0 and 1 (inclusive)"""
+        try:
+            return self.decisions[key]
+        except KeyError:
+            pass
 
-        if hasattr(key, "encode"):
-            key = key.encode('ascii')
-
-        value = (zlib.crc32(key, self.seed) & MAX_VALUE)
+        encoded = key.encode('ascii') if hasattr(key, "encode") else key
+        value = (zlib.crc32(encoded, self.seed) & MAX_VALUE) * INV_MAX_VALUE
 
-        return value * INV_MAX_VALUE
+        self.decisions[key] = value
+        return value
 
     def random(self, key):
         return self._random(key)
@@ -96,21 +173,32 @@ class RandomParameters(object):
         """Return perlin noise seede with the specified key.
         For parameters, check the PerlinNoise class."""
 
-        if hasattr(key, "encode"):
-            key = key.encode('ascii')
+        kwargs.setdefault("bounds", (-TABLE_MARGIN * self.size,
+                                     (1 + TABLE_MARGIN) * self.size))
+        kwargs.setdefault("min_octave_size", self.level_of_detail[0])
+
+        try:
+            value = self.noise_seeds[key]
+        except KeyError:
+            encoded = key.encode('ascii') if hasattr(key, "encode") else key
+            value = self.noise_seeds[key] = zlib.adler32(encoded, self.seed)
 
-        value = zlib.adler32(key, self.seed)
+        if self.stats is not None:
+            return InstrumentedPerlinNoise(self.stats, value, **kwargs)
         return PerlinNoise(value, **kwargs)
 
 
 def wrap_float(name):
     def wrapped(self, key, *args, **kwargs):
         try:
-            return float(self.values[key])
+            value = float(self.values[key])
         except ValueError:
             pass  # Override was provided, but wasn't a float.
         except KeyError:
             pass  # Override was not provided
+        else:
+            self.overridden[key] = value
+            return value
 
         parent = super(OverridableParameters, self)
         result = getattr(parent, name)(key, *args, **kwargs)
@@ -127,6 +215,9 @@ class OverridableParameters(RandomParameters):
         self.values = overrides
         self.results = dict()
 
+        # The overrides which have been used, and what they resolved to
+        self.overridden = dict()
+
     result = wrap_float("result")
     uniform = wrap_float("uniform")
 
@@ -152,13 +243,13 @@ class OverridableParameters(RandomParameters):
         # Find the matching key (case insensitive)
         for probability, option in probabilities:
             if str(option).lower() == choice:
-                self.results[key] = option
+                self.results[key] = self.overridden[key] = option
                 return option
 
         # for function or class-type choices, also check __name__
         for probability, option in probabilities:
             if option.__name__.lower() == choice:
-                self.results[key] = option.__name__
+                self.results[key] = self.overridden[key] = option.__name__
                 return option
 
         assert False, "Invalid value provided"
@@ -207,17 +298,74 @@ def _perlin_random(seed, x, y):
     return value
 
 
-def _get_octave(seed, coord):
+def _get_octave(seed, coord, table=None):
     x = coord.real
     y = coord.imag
 
     cellx = math.floor(x)
     celly = math.floor(y)
 
-    value00 = _perlin_random(seed, cellx, celly)
-    value10 = _perlin_random(seed, cellx + 1, celly)
-    value01 = _perlin_random(seed, cellx, celly + 1)
-    value11 = _perlin_random(seed, cellx + 1, celly + 1)
+    if table is not None:
+        value00, value10, value01, value11 = table.corners(cellx, celly)
+    else:
+        value00 = _perlin_random(seed, cellx, celly)
+        value10 = _perlin_random(seed, cellx + 1, celly)
+        value01 = _perlin_random(seed, cellx, celly + 1)
+        value11 = _perlin_random(seed, cellx + 1, celly + 1)
+
+    offsetx = x % 1.0
+    offsety = y % 1.0
+
+    value0 = offsetx * value10 + (1 - offsetx) * value00
+    value1 = offsetx * value11 + (1 - offsetx) * value01
+
+    result = offsety * value1 + (1 - offsety) * value0
+
+    return result * INV_MAX_VALUE
+
+
+def _make_crc32_table():
+    table = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ 0xEDB88320 if n & 1 else n >> 1
+        table.append(n)
+    return table
+
+
+if numpy is not None:
+    _CRC32_TABLE = numpy.array(_make_crc32_table(), dtype=numpy.uint32)
+
+
+def _perlin_random_many(seed, x, y):
+    """Array version of _perlin_random.
+
+    Inlines crc32 for the single byte b"x". Products are allowed to wrap
+    around, as crc32 only looks at the low 32 bits of its start value."""
+    crc = ((seed ^ y) * x).astype(numpy.uint32) ^ numpy.uint32(0xFFFFFFFF)
+    crc = _CRC32_TABLE[(crc ^ numpy.uint32(ord("x"))) & numpy.uint32(0xFF)] \
+        ^ (crc >> numpy.uint32(8))
+    crc ^= numpy.uint32(0xFFFFFFFF)
+
+    return (crc & numpy.uint32(MAX_VALUE)).astype(numpy.float64)
+
+
+def _get_octave_many(seed, coords, table=None):
+    """Array version of _get_octave, performing the exact same float
+    operations so results are identical."""
+    x = coords.real
+    y = coords.imag
+
+    cellx = numpy.floor(x).astype(numpy.int64)
+    celly = numpy.floor(y).astype(numpy.int64)
+
+    if table is not None:
+        value00, value10, value01, value11 = table.corners_many(cellx, celly)
+    else:
+        value00 = _perlin_random_many(seed, cellx, celly)
+        value10 = _perlin_random_many(seed, cellx + 1, celly)
+        value01 = _perlin_random_many(seed, cellx, celly + 1)
+        value11 = _perlin_random_many(seed, cellx + 1, celly + 1)
 
     offsetx = x % 1.0
     offsety = y % 1.0
@@ -230,15 +378,98 @@ def _get_octave(seed, coord):
     return result * INV_MAX_VALUE
 
 
+class LatticeTable(object):
+    """The lattice values of one noise octave, for a rectangle of cells.
+
+    Corner values are hashed when a cell is first used, and kept, so
+    samples in the same cell don't hash them again. Cells outside of the
+    rectangle are hashed every time."""
+
+    def __init__(self, seed, x0, y0, x1, y1):
+        self.seed = seed
+        self.x0 = x0
+        self.y0 = y0
+        self.width = x1 - x0 + 1
+        self.height = y1 - y0 + 1
+
+        self.cells = None  # Corner values, for scalar lookups
+        self.array = None  # Lattice values, for array lookups
+
+    def __len__(self):
+        return self.width * self.height
+
+    def corners(self, cellx, celly):
+        """Returns the values at the four corners of a cell"""
+        x = cellx - self.x0
+        y = celly - self.y0
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return self.hash_corners(cellx, celly)
+
+        if self.cells is None:
+            self.cells = [None] * len(self)
+
+        idx = y * self.width + x
+        result = self.cells[idx]
+        if result is None:
+            result = self.cells[idx] = self.hash_corners(cellx, celly)
+        return result
+
+    def hash_corners(self, cellx, celly):
+        seed = self.seed
+        return (_perlin_random(seed, cellx, celly),
+                _perlin_random(seed, cellx + 1, celly),
+                _perlin_random(seed, cellx, celly + 1),
+                _perlin_random(seed, cellx + 1, celly + 1))
+
+    def corners_many(self, cellx, celly):
+        """Array version of corners"""
+        stride = self.width + 1
+        if self.array is None:
+            ys, xs = numpy.mgrid[self.y0:self.y0 + self.height + 1,
+                                 self.x0:self.x0 + stride]
+            self.array = _perlin_random_many(self.seed, xs, ys).ravel()
+
+        x = cellx - self.x0
+        y = celly - self.y0
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        if inside.all():
+            idx = y * stride + x
+            return [self.array.take(idx), self.array.take(idx + 1),
+                    self.array.take(idx + stride),
+                    self.array.take(idx + stride + 1)]
+
+        idx = y[inside] * stride + x[inside]
+        result = []
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            values = _perlin_random_many(self.seed, cellx + dx, celly + dy)
+            values[inside] = self.array.take(idx + dy * stride + dx)
+            result.append(values)
+
+        return result
+
+
 try:
-    from ._natives import get_octave
+    from ._natives import get_octave, PerlinSampler
+    NOISE_BACKEND = "native"
 except ImportError:
     get_octave = _get_octave
+    PerlinSampler = None
+    NOISE_BACKEND = "python"
 
 
 class PerlinNoise():
+    """Perlin noise, with values between min_value and max_value.
+
+    bounds is an optional (min coord, max coord) pair for the area most
+    samples will be taken from. The lattice values of that area are kept in
+    tables, up to max_table_cells cells in total.
+
+    Octaves with cells smaller than min_octave_size are not evaluated, but
+    replaced by their average value."""
+
     def __init__(self, seed, octaves=None, detail=None,
-                 min_value=0, max_value=1, size=1.0):
+                 min_value=0, max_value=1, size=1.0, bounds=None,
+                 max_table_cells=MAX_TABLE_CELLS, min_octave_size=0):
 
         if not octaves:
             octaves = max(1, int(math.floor(math.log(size / detail, 2))))
@@ -257,11 +488,102 @@ class PerlinNoise():
             for (o, scale)
             in enumerate(scales)]
 
+        dropped = [octave for octave in self.octaves[1:]
+                   if size * octave[0] < min_octave_size]
+        if dropped:
+            self.octaves = self.octaves[:-len(dropped)]
+            octaves = len(self.octaves)
+
+            # Octaves average .5, so shift the range by what they'd add.
+            shift = .5 * sum(scale for scale, _, _ in dropped) * \
+                (max_value - min_value)
+            min_value += shift
+            max_value += shift
+            self.min_value = min_value
+            self.max_value = max_value
+
+        self.tables = [None] * octaves
+        if bounds is not None:
+            self.tables = self.get_tables(bounds, max_table_cells)
+
+        if PerlinSampler is not None:
+            self.sampler = PerlinSampler(self.octaves, self.inv_size,
+                                         min_value, max_value)
+        else:
+            self.sampler = None
+
+    def get_tables(self, bounds, max_table_cells):
+        """Returns a LatticeTable (or None) for every octave. Coarse octaves
+        come first, so when tables don't fit, fine octaves are hashed."""
+        minc, maxc = bounds
+        tables = []
+        for (scale, inv_scale, seed) in self.octaves:
+            x0 = int(math.floor(minc.real * self.inv_size * inv_scale))
+            y0 = int(math.floor(minc.imag * self.inv_size * inv_scale))
+            x1 = int(math.floor(maxc.real * self.inv_size * inv_scale))
+            y1 = int(math.floor(maxc.imag * self.inv_size * inv_scale))
+
+            table = None
+            if x0 <= x1 and y0 <= y1:
+                table = LatticeTable(seed, x0, y0, x1, y1)
+                if len(table) > max_table_cells:
+                    table = None
+                else:
+                    max_table_cells -= len(table)
+
+            tables.append(table)
+
+        return tables
+
     def __call__(self, coord):
+        if self.sampler is not None:
+            return self.sampler(coord)
+
         coord *= self.inv_size
-        value = sum(get_octave(seed, coord * inv_scale) * scale
-                    for (scale, inv_scale, seed) in self.octaves)
+        # Added one octave at a time, rather than with sum(), which uses
+        # compensated summation since Python 3.12: every backend must add in
+        # the same order to produce identical results.
+        value = 0
+        for (scale, inv_scale, seed), table in zip(self.octaves, self.tables):
+            value = value + _get_octave(seed, coord * inv_scale, table) * scale
 
         # Interpolate between min and max value
         return (value * self.max_value +
                 (1 - value) * self.min_value)
+
+    def evaluate_many(self, coords):
+        """Evaluates the noise for a sequence of complex coordinates.
+
+        Returns a numpy array when numpy is available, matching the scalar
+        path exactly. Without numpy, this falls back to a list."""
+        if numpy is None:
+            return [self(coord) for coord in coords]
+
+        coords = numpy.asarray(coords, dtype=numpy.complex128) * self.inv_size
+        value = 0
+        for (scale, inv_scale, seed), table in zip(self.octaves, self.tables):
+            value = value + \
+                _get_octave_many(seed, coords * inv_scale, table) * scale
+
+        # Interpolate between min and max value
+        return (value * self.max_value +
+                (1 - value) * self.min_value)
+
+
+class InstrumentedPerlinNoise(PerlinNoise):
+    """PerlinNoise which records evaluations in a stats.RenderStats"""
+
+    def __init__(self, stats, *args, **kwargs):
+        PerlinNoise.__init__(self, *args, **kwargs)
+        self.stats = stats
+
+    def __call__(self, coord):
+        self.stats.counts["noise_evaluations"] += 1
+        with self.stats.stage("noise"):
+            return PerlinNoise.__call__(self, coord)
+
+    def evaluate_many(self, coords):
+        self.stats.counts["noise_evaluations"] += len(coords) \
+            if numpy is None else numpy.size(coords)
+        with self.stats.stage("noise"):
+            return PerlinNoise.evaluate_many(self, coords)
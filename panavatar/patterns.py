@@ -1,5 +1,10 @@
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 SQ3 = math.sqrt(3.0)
 SQ2 = math.sqrt(3.0)
 INV3 = 1.0 / 3
@@ -30,7 +35,7 @@ def offset_shape(shape, offset):
     return [x + offset for x in shape]
 
 
-def get_tiles(params):
+def get_pattern(params):
 
     probabilities = [
         (20, Triangles),
@@ -48,7 +53,11 @@ def get_tiles(params):
 
     pattern = params.weighted_choice(probabilities, "pattern")
 
-    return pattern(params).generate_tiles()
+    return pattern(params)
+
+
+def get_tiles(params, max_offset=None):
+    return get_pattern(params).generate_tiles(max_offset=max_offset)
 
 
 class TilingPattern(object):
@@ -59,27 +68,201 @@ class TilingPattern(object):
     def __init__(self, params):
         self.params = params
 
-    def generate_tiles(self, overscan=.5):
-        # Later deformations may cause areas outside the main viewport to become
-        # visible, so we need to overscan to make sure there is something to see
-        # there.
-
-        scale = self.params.detail
+    def get_background(self, overscan=.5):
+        top_left = -overscan * self.params.size
+        bottom_right = (1 + overscan) * self.params.size
+        top_right = bottom_right.real + 1j * top_left.imag
+        bottom_left = top_left.real + 1j * bottom_right.imag
+        return [top_left, top_right, bottom_right, bottom_left]
+
+    def get_lattice(self, shape, overscan=.5, max_offset=None, scale=None,
+                    viewport=None):
+        """Returns the x and y positions at which shape is placed.
+
+        Later deformations may cause areas outside the main viewport to become
+        visible, so we need to overscan to make sure there is something to see
+        there. When max_offset is provided, it is called with the bounding box
+        of the overscanned area, and should return how far deformation can
+        move a point in it. Positions which can't end up in the viewport
+        (params.viewport by default) are then skipped."""
+
+        if scale is None:
+            scale = self.get_scale(overscan, max_offset)
         stride = self.stride * scale
-
-        if self.is_sparse:
-            top_left = -overscan * self.params.size
-            bottom_right = (1 + overscan) * self.params.size
-            top_right = bottom_right.real + 1j * top_left.imag
-            bottom_left = top_left.real + 1j * bottom_right.imag
-            yield [top_left, top_right, bottom_right, bottom_left], 0
+        start = -overscan * self.params.size
+        end = (1 + overscan) * self.params.size
+
+        xs = list(frange(start.real, end.real, stride.real))
+        ys = list(frange(start.imag, end.imag, stride.imag))
+
+        if max_offset is None:
+            return xs, ys
+
+        points = [point * scale for point in shape]
+        low_x = min(point.real for point in points)
+        low_y = min(point.imag for point in points)
+        high_x = max(point.real for point in points)
+        high_y = max(point.imag for point in points)
+
+        offset = max_offset(start + low_x + low_y * 1j,
+                           end + high_x + high_y * 1j)
+
+        view_min, view_max = viewport or self.params.viewport
+        xs = [x for x in xs
+              if x + high_x + offset >= view_min.real and
+              x + low_x - offset <= view_max.real]
+        ys = [y for y in ys
+              if y + high_y + offset >= view_min.imag and
+              y + low_y - offset <= view_max.imag]
+
+        return xs, ys
+
+    def get_parts(self, strips):
+        """Splits tile generation into parts, for use as params.lattice_part:
+        (shape index, strip, number of strips), with shape index -1 for the
+        background. Each shape's lattice is split in strips of columns.
+
+        Generating every part, in order, produces all tiles in order."""
+        parts = [(-1, 0, 1)] if self.is_sparse else []
+        parts.extend((idx, strip, strips)
+                     for idx in range(len(self.pattern))
+                     for strip in range(strips))
+        return parts
+
+    def has_background(self):
+        part = self.params.lattice_part
+        return self.is_sparse and (part is None or part[0] == -1)
+
+    def get_shapes(self, overscan=.5, max_offset=None, scale=None):
+        """Yields (shape, color, xs, ys) for every shape in the pattern, with
+        the lattice positions it is placed at. When params.lattice_part is
+        set, only that part is produced."""
+        part = self.params.lattice_part
+        if scale is None:
+            scale = self.get_scale(overscan, max_offset)
 
         for idx, shape in enumerate(self.pattern):
+            if part is not None and part[0] != idx:
+                continue
+
             color = self.colors[idx % len(self.colors)]
-            for pos in gridrange(-overscan * self.params.size,
-                                 (1 + overscan) * self.params.size,
-                                 stride):
-                yield [pos + point * scale for point in shape], color
+            xs, ys = self.get_lattice(shape, overscan, max_offset, scale)
+
+            if part is not None:
+                # Strips of lattice columns
+                _, strip, strips = part
+                xs = xs[len(xs) * strip // strips:
+                        len(xs) * (strip + 1) // strips]
+
+            yield shape, color, xs, ys
+
+    def get_scale(self, overscan=.5, max_offset=None):
+        """Returns the size of the tiles, which is params.detail, unless that
+        would produce more than params.max_polygons tiles. Then the tiles are
+        made larger, until at most max_polygons tiles are produced for the
+        whole image (whether or not they are visible after deformation), so
+        windows and parts of the image all use the same scale."""
+        scale = self.params.detail
+
+        max_polygons = self.params.max_polygons
+        if not max_polygons:
+            return scale
+        if max_polygons < 0:
+            raise ValueError("max_polygons can't be negative")
+
+        # Start from the number of tiles covering the image
+        size = self.params.size
+        density = len(self.pattern) / (self.stride.real * self.stride.imag)
+        scale = max(scale, math.sqrt(size.real * size.imag * density /
+                                     max_polygons))
+
+        # Beyond this scale, there's one lattice position per shape.
+        max_scale = (1 + 2 * overscan) * max(size.real, size.imag) / \
+            min(self.stride.real, self.stride.imag)
+
+        while scale < max_scale:
+            count = self.count_tiles(overscan, max_offset, scale)
+            if count <= max_polygons:
+                break
+            scale *= max(1.01, math.sqrt(count / max_polygons))
+
+        return scale
+
+    def count_tiles(self, overscan, max_offset, scale):
+        """Returns the number of tiles produced for the whole image"""
+        count = 1 if self.is_sparse else 0
+        for shape in self.pattern:
+            xs, ys = self.get_lattice(shape, overscan, max_offset, scale,
+                                      (0j, self.params.size))
+            count += len(xs) * len(ys)
+        return count
+
+    def generate_tiles(self, overscan=.5, max_offset=None):
+        scale = self.get_scale(overscan, max_offset)
+
+        if self.has_background():
+            yield self.get_background(overscan), 0
+
+        for shape, color, xs, ys in self.get_shapes(overscan, max_offset,
+                                                     scale):
+            for x in xs:
+                for y in ys:
+                    pos = x + y * 1j
+                    yield [pos + point * scale for point in shape], color
+
+    def generate_tile_arrays(self, overscan=.5, max_offset=None):
+        """Like generate_tiles, but yields a (n_tiles, n_vertices) complex
+        array per pattern shape. Requires numpy.
+
+        The lattice is computed by broadcasting, but with the same float
+        operations as generate_tiles, so the coordinates are identical."""
+
+        scale = self.get_scale(overscan, max_offset)
+
+        if self.has_background():
+            yield numpy.array([self.get_background(overscan)]), 0
+
+        for shape, color, xs, ys in self.get_shapes(overscan, max_offset,
+                                                     scale):
+            xs = numpy.array(xs, dtype=numpy.float64)
+            ys = numpy.array(ys, dtype=numpy.float64)
+            positions = (xs[:, None] + ys[None, :] * 1j).reshape(-1, 1)
+            points = numpy.array(shape, dtype=numpy.complex128) * scale
+            yield positions + points[None, :], color
+
+    def generate_indexed_tiles(self, overscan=.5, max_offset=None):
+        """Like generate_tile_arrays, but returns a table of unique vertices,
+        and a list of (indices, color) pairs; with indices a (n_tiles,
+        n_vertices) array of indices into the vertex table.
+
+        Neighbouring tiles share most of their vertices, so this allows
+        expensive operations to be applied once per vertex. Requires numpy."""
+
+        arrays = list(self.generate_tile_arrays(overscan, max_offset))
+        if not arrays:
+            return numpy.zeros(0, dtype=numpy.complex128), []
+
+        flat = numpy.concatenate([tiles.ravel() for tiles, _ in arrays])
+
+        # numpy.unique(flat, return_inverse=True), but a stable argsort
+        # of complex numbers is several times faster than its sort.
+        order = numpy.argsort(flat, kind="stable")
+        ordered = flat[order]
+        is_first = numpy.empty(len(ordered), dtype=bool)
+        is_first[:1] = True
+        numpy.not_equal(ordered[1:], ordered[:-1], out=is_first[1:])
+        vertices = ordered[is_first]
+        inverse = numpy.empty(len(flat), dtype=numpy.intp)
+        inverse[order] = numpy.cumsum(is_first) - 1
+
+        indexed = []
+        offset = 0
+        for tiles, color in arrays:
+            indices = inverse[offset:offset + tiles.size].reshape(tiles.shape)
+            indexed.append((indices, color))
+            offset += tiles.size
+
+        return vertices, indexed
 
 
 class Squares(TilingPattern):
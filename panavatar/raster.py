@@ -0,0 +1,102 @@
+import math
+import struct
+import zlib
+
+
+class Canvas(object):
+    """An RGBA pixel buffer, onto which polygons can be filled.
+
+    Pixels are sampled at their centers, using the nonzero fill rule (the
+    SVG default). Polygons sharing an edge therefore never both cover a
+    pixel, and never leave a gap between them."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height * 4)
+
+    def fill_polygon(self, shape, color):
+        """Fills a polygon, given as a list of complex coordinates, with an
+        RGBA color given as 4 bytes."""
+
+        min_y = min(coord.imag for coord in shape)
+        max_y = max(coord.imag for coord in shape)
+
+        first_row = max(0, int(math.ceil(min_y - .5)))
+        last_row = min(self.height, int(math.ceil(max_y - .5)))
+
+        edges = list(zip(shape, shape[1:] + shape[:1]))
+        stride = self.width * 4
+
+        for row in range(first_row, last_row):
+            y = row + .5
+
+            # Find where the edges cross this scanline, and in which direction
+            crossings = []
+            for start, end in edges:
+                if start.imag <= y < end.imag:
+                    direction = 1
+                elif end.imag <= y < start.imag:
+                    direction = -1
+                else:
+                    continue
+
+                t = (y - start.imag) / (end.imag - start.imag)
+                crossings.append((start.real + t * (end.real - start.real),
+                                  direction))
+
+            crossings.sort()
+
+            winding = 0
+            offset = row * stride
+            for idx, (x, direction) in enumerate(crossings[:-1]):
+                winding += direction
+                if not winding:
+                    continue
+
+                first = max(0, int(math.ceil(x - .5)))
+                last = min(self.width,
+                           int(math.ceil(crossings[idx + 1][0] - .5)))
+                if first < last:
+                    self.pixels[offset + first * 4:offset + last * 4] = \
+                        color * (last - first)
+
+    def get_png(self):
+        """Encodes the canvas as a PNG image"""
+        stride = self.width * 4
+
+        # Each row is prefixed by its filter type; we don't filter.
+        raw = b"".join(b"\0" + bytes(self.pixels[offset:offset + stride])
+                       for offset in range(0, len(self.pixels), stride))
+
+        header = struct.pack(">IIBBBBB", self.width, self.height,
+                             8, 6, 0, 0, 0)  # 8 bit RGBA
+
+        return (b"\x89PNG\r\n\x1a\n" +
+                png_chunk(b"IHDR", header) +
+                png_chunk(b"IDAT", zlib.compress(raw, 6)) +
+                png_chunk(b"IEND", b""))
+
+
+def png_chunk(chunk_type, data):
+    checksum = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", checksum))
+
+
+def rasterize(width, height, polygons):
+    """Fills the (shape, color) pairs, with color as a hex string, onto a new
+    canvas."""
+    canvas = Canvas(width, height)
+    rgba = {}
+
+    for shape, color in polygons:
+        try:
+            color_bytes = rgba[color]
+        except KeyError:
+            color_bytes = rgba[color] = bytes(bytearray.fromhex(color)) + \
+                b"\xff"
+
+        canvas.fill_polygon(shape, color_bytes)
+
+    return canvas
@@ -0,0 +1,75 @@
+import collections
+import contextlib
+import time
+
+
+class RenderStats(object):
+    """Collects timing and counts while rendering.
+
+    Pass an instance as the stats argument of get_svg_iter (or get_svg,
+    get_png). Rendering without stats doesn't pay for any of this.
+
+    Time is attributed to the innermost active stage, so stage times don't
+    overlap, and add up to (about) the total render time. Stages are:
+
+    - tiles: generating the tiling pattern
+    - deform: applying deformations, excluding noise
+    - noise: evaluating perlin noise, for deformations and colors
+    - cull: computing bounding boxes and centroids, and culling
+    - color: determining polygon colors, excluding noise
+    - serialize: producing the output
+    """
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self._stages = []
+        self._mark = None
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stages:
+            self.times[self._stages[-1]] += now - self._mark
+        self._stages.append(stage)
+        self._mark = now
+
+    def leave(self):
+        now = time.perf_counter()
+        self.times[self._stages.pop()] += now - self._mark
+        self._mark = now
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        self.enter(stage)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def timed(self, stage, iterable):
+        """Passes through iterable, attributing time spent producing items
+        to stage."""
+        iterator = iter(iterable)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            yield item
+
+    def as_dict(self):
+        result = dict(("%s_ms" % stage, round(seconds * 1000, 3))
+                      for stage, seconds in self.times.items())
+        result.update(self.counts)
+        return result
+
+    def get_server_timing(self):
+        """Formats the stage times as a Server-Timing header"""
+        return ", ".join("%s;dur=%.3f" % (stage, seconds * 1000)
+                         for stage, seconds in sorted(self.times.items()))
+
+    def __str__(self):
+        return " ".join("%s=%s" % item for item in sorted(self.as_dict().items()))
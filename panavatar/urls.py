@@ -5,6 +5,10 @@ import panavatar.djangoview
 urlpatterns = [
     url(r'^(?P<width>\d+)x(?P<height>\d+).svg$',
         panavatar.djangoview.generate_image_svg, name='bg'),
+    url(r'^(?P<width>\d+)x(?P<height>\d+)/(?P<seed>.+)/'
+        r'(?P<x>\d+),(?P<y>\d+),'
+        r'(?P<window_width>\d+)x(?P<window_height>\d+).svg$',
+        panavatar.djangoview.generate_window_svg, name='bg-window'),
     url(r'^(?P<width>\d+)x(?P<height>\d+)/(?P<seed>.+).svg$',
         panavatar.djangoview.generate_image_svg, name='bg'),
 ]
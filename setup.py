@@ -1,22 +1,38 @@
 import os
+import sys
 from setuptools import setup
 from distutils.extension import Extension
 
 
-ext_modules = [
-    Extension("panavatar._natives", ["panavatar/_natives.c"]),
-]
+# The native noise generator must round exactly like the python fallback,
+# so don't let the compiler fuse multiplications and additions.
+extra_compile_args = [] if sys.platform == "win32" else ["-ffp-contract=off"]
+
+
+def native_extension(source):
+    # The extension is optional; if it fails to build, panavatar falls back
+    # to the pure python implementation.
+    return Extension("panavatar._natives", [source],
+                     libraries=["z"],
+                     extra_compile_args=extra_compile_args,
+                     optional=True)
+
+
+ext_modules = []
+
+if os.path.exists("panavatar/_natives.c"):
+    ext_modules = [native_extension("panavatar/_natives.c")]
 
 if os.path.exists("panavatar/_natives.pyx"):
     try:
         from Cython.Build import cythonize
-        ext_modules = cythonize("panavatar/_natives.pyx")
+        ext_modules = cythonize([native_extension("panavatar/_natives.pyx")])
     except ImportError:
         pass
 
 setup(
     name='panavatar',
-    version='0.3.2',
+    version='0.4.0',
     url='https://github.com/ondergetekende/python-panavatar',
     description=(
         'Panavatar generates pseudorandom abstract wallpapers'
@@ -25,6 +41,10 @@ setup(
     author_email='koert@ondergetekende.nl',
     packages=['panavatar'],
     ext_modules=ext_modules,
+    extras_require={
+        # Renders using numpy arrays, producing identical images faster
+        'fast': ['numpy'],
+    },
     # setup_requires=["cython"],
     classifiers=[
         'Intended Audience :: Developers',
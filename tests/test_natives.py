@@ -0,0 +1,69 @@
+"""Checks the native noise generator matches the pure python one exactly"""
+
+import random
+import unittest
+
+from panavatar import parameters
+
+try:
+    from panavatar import _natives
+except ImportError:
+    _natives = None
+
+
+SEEDS = [0, 1, 541, 0x3FFFFFFF] + \
+    [random.Random(seed).getrandbits(30) for seed in range(50)]
+
+
+def get_coords(rng, count=200):
+    coords = [0j, 1 + 1j, -1 - 1j, 0.5 - 0.5j, -1e-12 + 1e-12j,
+              1e9 - 1e9j, -1e12 + 3e11j, 2 ** 40 + 0.25j]
+    for _ in range(count):
+        magnitude = 10 ** rng.uniform(-3, 12)
+        coords.append(complex(rng.uniform(-magnitude, magnitude),
+                              rng.uniform(-magnitude, magnitude)))
+    return coords
+
+
+@unittest.skipIf(_natives is None, "native extension not built")
+class NativesParityTest(unittest.TestCase):
+
+    def test_get_octave(self):
+        rng = random.Random(1)
+        for seed in SEEDS:
+            for coord in get_coords(rng):
+                self.assertEqual(_natives.get_octave(seed, coord),
+                                 parameters._get_octave(seed, coord),
+                                 (seed, coord))
+
+    def test_perlin_sampler(self):
+        rng = random.Random(2)
+        for seed in SEEDS:
+            noise = parameters.PerlinNoise(
+                seed, octaves=rng.randint(1, 12),
+                min_value=rng.uniform(-2, 0), max_value=rng.uniform(0, 2),
+                size=rng.uniform(10, 5000))
+            sampler = noise.sampler
+            self.assertIsNotNone(sampler)
+
+            noise.sampler = None  # Use the pure python implementation
+            for coord in get_coords(rng, 50):
+                self.assertEqual(sampler(coord), noise(coord), (seed, coord))
+
+    def test_perlin_sampler_with_tables(self):
+        rng = random.Random(3)
+        for seed in SEEDS[:10]:
+            noise = parameters.PerlinNoise(
+                seed, detail=2.0, size=1000.0,
+                bounds=(-100 - 100j, 1100 + 700j))
+            sampler = noise.sampler
+
+            noise.sampler = None
+            for _ in range(200):
+                coord = complex(rng.uniform(-200, 1200),
+                                rng.uniform(-200, 800))
+                self.assertEqual(sampler(coord), noise(coord), (seed, coord))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Checks the array versions of the noise match the scalar ones exactly"""
+
+import random
+import unittest
+
+from panavatar import parameters
+
+from test_natives import SEEDS, get_coords
+
+
+@unittest.skipIf(parameters.numpy is None, "numpy not installed")
+class EvaluateManyTest(unittest.TestCase):
+
+    def check(self, noise, coords):
+        noise.sampler = None  # Compare with the pure python implementation
+        values = noise.evaluate_many(coords).tolist()
+        for coord, value in zip(coords, values):
+            self.assertEqual(value, noise(coord), coord)
+
+    def test_evaluate_many(self):
+        rng = random.Random(4)
+        for seed in SEEDS:
+            noise = parameters.PerlinNoise(
+                seed, octaves=rng.randint(1, 12),
+                min_value=rng.uniform(-2, 0), max_value=rng.uniform(0, 2),
+                size=rng.uniform(10, 5000))
+            self.check(noise, get_coords(rng, 50))
+
+    def test_evaluate_many_with_tables(self):
+        rng = random.Random(5)
+        for seed in SEEDS[:10]:
+            noise = parameters.PerlinNoise(
+                seed, detail=2.0, size=1000.0,
+                bounds=(-100 - 100j, 1100 + 700j))
+            self.assertTrue(any(table is not None for table in noise.tables))
+
+            # Mostly inside the tables, but some outside of them
+            coords = [complex(rng.uniform(-200, 1200), rng.uniform(-200, 800))
+                      for _ in range(500)]
+            self.check(noise, coords + get_coords(rng, 50))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Checks images are identical with and without numpy"""
+
+import unittest
+from unittest import mock
+
+import panavatar
+from panavatar import geometry, parameters, patterns
+
+PATTERNS = ["triangles", "squares", "barssquares", "beehive", "blocks",
+            "corner", "brick", "roadbrick", "sparsesquares"]
+
+
+def get_cases():
+    for seed in ["a", "b", "hello"]:
+        yield 320, 200, {"seed": seed}
+
+    for pattern in PATTERNS:
+        yield 300, 200, {"seed": "numpy", "pattern": pattern,
+                         "have_crumple": "1", "have_wave": "1",
+                         "have_zoom": "1"}
+
+    yield 300, 200, {"seed": "numpy", "have_zoom": "1",
+                     "have_crumple": "0", "have_wave": "0"}
+    yield 640, 480, {"seed": "window", "have_crumple": "1"}
+
+
+@unittest.skipIf(parameters.numpy is None, "numpy not installed")
+class WithoutNumpyTest(unittest.TestCase):
+
+    def test_get_svg(self):
+        for width, height, params in get_cases():
+            expected = panavatar.get_svg(width, height, params)
+
+            with mock.patch.object(geometry, "numpy", None), \
+                    mock.patch.object(patterns, "numpy", None), \
+                    mock.patch.object(parameters, "numpy", None):
+                svg = panavatar.get_svg(width, height, params)
+
+            self.assertEqual(svg, expected, params)
+
+    def test_window(self):
+        params = {"seed": "window", "have_crumple": "1", "have_zoom": "1"}
+        window = (100, 50, 200, 150)
+        expected = panavatar.get_svg(640, 480, params, window=window)
+
+        with mock.patch.object(geometry, "numpy", None), \
+                mock.patch.object(patterns, "numpy", None), \
+                mock.patch.object(parameters, "numpy", None):
+            svg = panavatar.get_svg(640, 480, params, window=window)
+
+        self.assertEqual(svg, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Checks renders on several threads produce the same image as serial ones"""
+
+import threading
+import unittest
+
+import panavatar
+
+THREADS = 8
+RENDERS = 10
+
+
+def render_on_threads(render):
+    """Calls render RENDERS times on each of THREADS threads, started at
+    once, and returns the results"""
+    barrier = threading.Barrier(THREADS)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        for _ in range(RENDERS):
+            svg = render()
+            with lock:
+                results.append(svg)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class ThreadsTest(unittest.TestCase):
+    params = {"seed": "threads", "have_crumple": "1", "have_wave": "1",
+              "have_zoom": "1", "color_filter": "noise_vignette"}
+
+    def test_context(self):
+        context = panavatar.get_context(320, 200, self.params)
+        expected = panavatar.get_svg(320, 200, self.params)
+
+        results = render_on_threads(
+            lambda: panavatar.get_svg(320, 200, context))
+
+        self.assertEqual(len(results), THREADS * RENDERS)
+        for svg in results:
+            self.assertEqual(svg, expected)
+
+    def test_dict(self):
+        params = dict(self.params)
+        expected = panavatar.get_svg(320, 200, params)
+
+        results = render_on_threads(
+            lambda: panavatar.get_svg(320, 200, params))
+
+        self.assertEqual(len(results), THREADS * RENDERS)
+        for svg in results:
+            self.assertEqual(svg, expected)
+
+        # The dict is shared by all renders, but isn't changed by them.
+        self.assertEqual(params, self.params)
+
+
+if __name__ == "__main__":
+    unittest.main()